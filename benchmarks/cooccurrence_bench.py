@@ -0,0 +1,36 @@
+# Rebuild time of the recommender's co-occurrence table at millions of order items.
+# Run from the repository root: python benchmarks/cooccurrence_bench.py [products] [neighbors]
+# Orders hold 1-6 items drawn from a skewed popularity, like a real catalog.
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "recommender"))
+import cooccurrence
+
+ITEMS = [1_000_000, 2_000_000, 5_000_000, 10_000_000]
+
+def synthetic_items(count: int, num_products: int, rng):
+    sizes = rng.integers(1, 7, size=count // 2)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), count) + 1]
+    order_idx = np.repeat(np.arange(len(sizes)), sizes)[:count]
+    weights = 1.0 / np.arange(1, num_products + 1)
+    product_idx = rng.choice(num_products, size=len(order_idx), p=weights / weights.sum())
+    return order_idx.astype(np.int32), product_idx.astype(np.int32)
+
+def main():
+    num_products = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    top_n = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = np.random.default_rng(0)
+    print(f"{num_products} products, top {top_n} neighbors each")
+    for count in ITEMS:
+        order_idx, product_idx = synthetic_items(count, num_products, rng)
+        start = time.perf_counter()
+        indptr, neighbors, counts = cooccurrence.build_neighbors(order_idx, product_idx, num_products, top_n)
+        elapsed = time.perf_counter() - start
+        print(f"{count:>10} items, {order_idx[-1] + 1:>9} orders: rebuilt in {elapsed:.2f}s, "
+              f"{len(neighbors)} neighbor entries, {count / elapsed:.0f} items/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Reservation throughput on a single product as concurrency rises, with and
+# without the product in escrow mode, and an oversell check on scarce stock.
+# Run from the repository root: python benchmarks/escrow_bench.py [reservations_per_thread]
+import os
+import sys
+import time
+import pickle
+import tempfile
+import subprocess
+import threading
+
+INVENTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "inventory")
+PRODUCT_ID = "1"
+THREADS = [1, 2, 4, 8, 16, 32]
+
+def child(threads: int, per_thread: int, stock: int):
+    # runs inside a scratch directory with the env already set up by main()
+    with open("stocks.pkl", "wb") as f:
+        pickle.dump({PRODUCT_ID: stock}, f)
+    sys.path.insert(0, INVENTORY_DIR)
+    import app as inventory
+
+    accepted = [0] * threads
+
+    def worker(n):
+        client = inventory.app.test_client()
+        for i in range(per_thread):
+            response = client.post("/api/inventory/check_and_reserve", json={
+                "reservation_id": f"{n}-{i}", "product_ids": [PRODUCT_ID], "quantities": [1]
+            })
+            if response.status_code == 200:
+                accepted[n] += 1
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    # release every other reservation, stock has to come back exactly
+    client = inventory.app.test_client()
+    released = 0
+    for n in range(threads):
+        for i in range(0, per_thread, 2):
+            if client.post("/api/inventory/release", json={"reservation_id": f"{n}-{i}"}).json.get("restored"):
+                released += 1
+    left = inventory.stock_level(PRODUCT_ID)
+    reserved = sum(accepted) - released
+    ok = left >= 0 and left + reserved == stock and sum(accepted) <= stock
+    print(f"{threads} {elapsed} {sum(accepted)} {ok}")
+
+def run(mode: str, threads: int, per_thread: int, stock: int) -> tuple[float, int, bool]:
+    # no commit window, otherwise a lone writer measures the window rather than lock contention
+    env = dict(os.environ, WAL_DIR="wal", WAL_FSYNC=os.environ.get("WAL_FSYNC", "never"), SWEEP_INTERVAL="3600",
+               GROUP_COMMIT_WINDOW_MS=os.environ.get("GROUP_COMMIT_WINDOW_MS", "0"))
+    if mode == "escrow":
+        env["HOT_PRODUCTS"] = PRODUCT_ID
+    with tempfile.TemporaryDirectory() as scratch:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", str(threads), str(per_thread), str(stock)],
+            cwd=scratch, env=env, capture_output=True, text=True, check=True
+        ).stdout.split()
+    return float(out[-3]), int(out[-2]), out[-1] == "True"
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        child(*map(int, sys.argv[2:5]))
+        return
+    per_thread = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"WAL_FSYNC={os.environ.get('WAL_FSYNC', 'never')}, GROUP_COMMIT_WINDOW_MS={os.environ.get('GROUP_COMMIT_WINDOW_MS', '0')}, "
+          f"{per_thread} reservations per thread")
+    for mode in ("single", "escrow"):
+        for threads in THREADS:
+            elapsed, accepted, ok = run(mode, threads, per_thread, 10**9)
+            print(f"{mode:7} {threads:3} threads  {accepted / elapsed:9.0f} reservations/s  consistent={ok}")
+
+    # scarce stock: twice as many requests as units, exactly the stock may succeed
+    for mode in ("single", "escrow"):
+        threads = 16
+        stock = threads * per_thread // 2
+        _, accepted, ok = run(mode, threads, per_thread, stock)
+        print(f"{mode:7} scarce: {accepted}/{threads * per_thread} accepted for stock {stock}  consistent={ok}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Write throughput and recovery time of the order service's write-ahead log.
+# Run from the repository root: python benchmarks/order_log_bench.py [orders]
+# Each order is stored as one order record plus two item records.
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import threading
+
+ORDER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "order")
+WRITERS = 16
+
+def write(count: int):
+    start = time.perf_counter()
+    sys.path.insert(0, ORDER_DIR)
+    import app as orders
+    assert orders.app.is_ready
+
+    def worker(n):
+        # same steps as the POST handlers, without the http layer
+        for i in range(n, count, WRITERS):
+            order_id = f"o{i}"
+            records = [{"op": "order", "order": {
+                "id": order_id, "user_id": str(i % 10000), "time": f"{i:012d}", "total_price_in_cents": 1999,
+                "address_name": "Jane Doe", "address1": "1 Main St", "address2": "", "credit_card_company": "Visa",
+                "credit_card_number": "4111111111111111", "credit_card_expiry": "12/30", "shipping_workflow_id": f"s{i}"
+            }}]
+            records += [{"op": "item", "item": {"id": f"{order_id}-{j}", "product_id": str(j), "order_id": order_id, "quantity": 1}} for j in range(2)]
+            for record in records:
+                with orders.lock:
+                    ticket = orders.commit(record)
+                orders.group.wait(ticket)
+
+    print(f"startup {time.perf_counter() - start:.2f}s")
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(WRITERS)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    metrics = orders.group.metrics()
+    print(f"wrote {count} orders in {elapsed:.2f}s: {count / elapsed:.0f} orders/s, "
+          f"{count * 3 / elapsed:.0f} records/s, avg batch {metrics['avg_batch_size']:.1f}")
+
+def recover():
+    start = time.perf_counter()
+    sys.path.insert(0, ORDER_DIR)
+    import app as orders
+    assert orders.app.is_ready
+    print(f"recovered {len(orders.orders)} orders, {len(orders.order_items)} items in {time.perf_counter() - start:.2f}s")
+
+def child(scratch: str, env: dict, *args):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", *args],
+                         cwd=scratch, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr)
+    return out.stdout.strip().splitlines()[-1]
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        write(int(sys.argv[3])) if sys.argv[2] == "write" else recover()
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    for fsync in ("always", "interval"):
+        for snapshot_every in (10**12, 300_000):
+            env = dict(os.environ, WAL_DIR="wal", WAL_FSYNC=fsync, SNAPSHOT_EVERY=str(snapshot_every), SNAPSHOT_INTERVAL="3600")
+            label = f"fsync={fsync:8} " + ("log only" if snapshot_every == 10**12 else f"snapshot every {snapshot_every} records")
+            with tempfile.TemporaryDirectory() as scratch:
+                print(f"{label}: {child(scratch, env, 'write', str(count))}")
+                print(f"{label}: {child(scratch, env, 'recover')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Query latency of the product search index on a synthetic catalog.
+# Run from the repository root: python benchmarks/search_bench.py [num_products]
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "product"))
+from search import SearchIndex
+
+WORDS = [
+    "black", "green", "white", "herbal", "rooibos", "oolong", "tea", "blend", "leaf", "loose",
+    "organic", "smoky", "floral", "fruity", "citrus", "vanilla", "jasmine", "mint", "ginger", "lemon",
+    "peach", "berry", "spiced", "chai", "classic", "premium", "morning", "evening", "calm", "bold",
+    "infuser", "cup", "pot", "mug", "glass", "steel", "ceramic", "travel", "gift", "set",
+]
+QUERIES = ["green tea", "jasmine", "smoky black", "vanil", "organic loose leaf", "ceramic mug", "chai sp", "t", "w"]
+
+def synthetic_docs(n, seed=42):
+    rng = random.Random(seed)
+    vocab = WORDS + [f"w{i}" for i in range(5000)]  # long tail of rare terms
+    for i in range(n):
+        name = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4)))
+        description = " ".join(rng.choice(vocab) for _ in range(rng.randint(8, 20)))
+        yield str(i), name, description
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    docs = list(synthetic_docs(n))
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.build(docs)
+    print(f"build: {n} products in {time.perf_counter() - start:.2f}s, {len(index.terms)} terms")
+
+    added = list(synthetic_docs(1000, seed=7))
+    start = time.perf_counter()
+    for doc_id, name, description in added:
+        index.add(f"new-{doc_id}", name, description)
+    print(f"incremental add: {(time.perf_counter() - start) * 1000 / len(added):.3f}ms per product")
+
+    for query in QUERIES:
+        runs = 200
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            index.search(query, k=20)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        p50 = timings[runs // 2] * 1000
+        p99 = timings[int(runs * 0.99)] * 1000
+        print(f"{query!r:24} p50 {p50:.3f}ms  p99 {p99:.3f}ms")
+
+if __name__ == "__main__":
+    main()
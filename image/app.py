@@ -1,12 +1,215 @@
 import os
+import io
+import time
+import json
 import base64
-from flask import Flask, jsonify, request
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from flask import Flask, Response, jsonify, request, abort
+
+try:
+    from PIL import Image
+except ImportError:  # without pillow every size is served as the original
+    Image = None
 
 app = Flask(__name__)
 app.is_ready = False
 IMAGE_FOLDER = "images"
+IMAGE_MAX_AGE = int(os.environ.get("IMAGE_MAX_AGE", 31536000))  # seconds browsers/proxies may cache an image
+IMAGE_CACHE_BYTES = int(os.environ.get("IMAGE_CACHE_BYTES", 64 * 1024 * 1024))  # raw + base64 bytes kept in memory
+IMAGE_REFRESH_INTERVAL = float(os.environ.get("IMAGE_REFRESH_INTERVAL", 5))  # seconds between mtime checks per image
+VARIANT_FOLDER = os.environ.get("VARIANT_FOLDER", "variants")
+VARIANT_WORKERS = int(os.environ.get("VARIANT_WORKERS", 2))
+
+# bounding box in pixels per size, "full" is the original file
+VARIANT_SIZES = {
+    "thumb": 72,
+    "card": 150,
+}
+FULL_SIZE = "full"
+VARIANT_FORMATS = {
+    "png": "image/png",
+    "webp": "image/webp",
+}
+# formats built at startup, should match the webui's IMAGE_VARIANT_FORMAT
+PRELOAD_FORMATS = [fmt for fmt in os.environ.get("PRELOAD_FORMATS", "webp").split(",") if fmt in VARIANT_FORMATS]
+
+class ImageEntry:
+    def __init__(self, name: str, data: bytes, mtime: float, mimetype: str = "image/png", key: str | None = None):
+        self.key = key or name
+        self.name = name
+        self.data = data
+        self.mtime = mtime
+        self.mimetype = mimetype
+        self.checked_at = time.monotonic()
+        self.etag = hashlib.sha256(data).hexdigest()
+        self.source_etag = self.etag  # etag of the original a variant was built from
+        self.data_uri = f"data:{mimetype};base64," + base64.b64encode(data).decode("utf-8")
+        # pre-serialized '"name": "data:..."' member of the /api/images json object
+        self.json_member = json.dumps(name) + ":" + json.dumps(self.data_uri)
+        self.size = len(data) + len(self.data_uri) + len(self.json_member)
+
+class ImageStore:
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, ImageEntry] = OrderedDict()
+        self.total_bytes = 0
+        self.lock = Lock()
+        self.pool = ThreadPoolExecutor(max_workers=VARIANT_WORKERS)
+        self.pending: dict[str, Future] = {}
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.folder, name+".png")
+
+    def preload(self):
+        for filename in sorted(os.listdir(self.folder)):
+            if filename.endswith(".png"):
+                original = self.get(filename[:-len(".png")])
+                if original is None or Image is None:
+                    continue
+                # build the default variants in the background
+                for size in VARIANT_SIZES:
+                    for fmt in PRELOAD_FORMATS:
+                        self.submit_variant(original, f"{original.name}@{size}.{fmt}", size, fmt)
+
+    def load(self, name: str) -> ImageEntry | None:
+        filepath = self.path(name)
+        try:
+            mtime = os.stat(filepath).st_mtime
+            with open(filepath, "rb") as img_file:
+                return ImageEntry(name, img_file.read(), mtime)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Failed to read {name}: {e}")
+            return None
+
+    def get(self, name: str) -> ImageEntry | None:
+        # "@" is reserved for the variant keys that share entries with the originals
+        if os.path.basename(name) != name or "@" in name:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None:
+                self.entries.move_to_end(name)
+                if time.monotonic() - entry.checked_at < IMAGE_REFRESH_INTERVAL:
+                    return entry
+
+        if entry is not None:
+            # revalidate against the file on disk
+            try:
+                mtime = os.stat(self.path(name)).st_mtime
+            except OSError:
+                mtime = None
+            if mtime == entry.mtime:
+                entry.checked_at = time.monotonic()
+                return entry
+            if mtime is None:
+                self.discard(name)
+                return None
+
+        entry = self.load(name)
+        if entry is not None:
+            self.put(entry)
+        return entry
+
+    def get_variant(self, name: str, size: str, fmt: str = "png") -> ImageEntry | None:
+        if size == FULL_SIZE or Image is None:
+            return self.get(name)
+        original = self.get(name)
+        if original is None:
+            return None
+        key = f"{name}@{size}.{fmt}"
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.source_etag == original.etag:
+                self.entries.move_to_end(key)
+                return entry
+        return self.submit_variant(original, key, size, fmt).result()
+
+    def submit_variant(self, original: ImageEntry, key: str, size: str, fmt: str) -> Future:
+        with self.lock:
+            # concurrent requests for the same variant share one build
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pool.submit(self.build_variant, original, key, size, fmt)
+                self.pending[key] = future
+            return future
+
+    def build_variant(self, original: ImageEntry, key: str, size: str, fmt: str) -> ImageEntry:
+        try:
+            return self.render_variant(original, key, size, fmt)
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def render_variant(self, original: ImageEntry, key: str, size: str, fmt: str) -> ImageEntry:
+        # the disk cache is keyed by the source content so stale variants are never picked up
+        filepath = os.path.join(VARIANT_FOLDER, f"{original.name}.{size}.{original.etag[:16]}.{fmt}")
+        if os.path.exists(filepath):
+            with open(filepath, "rb") as f:
+                data = f.read()
+        else:
+            box = VARIANT_SIZES[size]
+            with Image.open(io.BytesIO(original.data)) as img:
+                img.thumbnail((box, box))
+                out = io.BytesIO()
+                if fmt == "webp":
+                    img.save(out, format="WEBP", quality=80, method=4)
+                else:
+                    img.save(out, format="PNG", optimize=True)
+                data = out.getvalue()
+            try:
+                os.makedirs(VARIANT_FOLDER, exist_ok=True)
+                tmp_path = filepath + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, filepath)
+            except OSError as e:
+                print(f"Failed to cache variant {key}: {e}")
+
+        entry = ImageEntry(original.name, data, original.mtime, VARIANT_FORMATS[fmt], key=key)
+        entry.source_etag = original.etag
+        self.put(entry)
+        return entry
+
+    def put(self, entry: ImageEntry):
+        with self.lock:
+            old = self.entries.pop(entry.key, None)
+            if old is not None:
+                self.total_bytes -= old.size
+            if entry.size > self.max_bytes:
+                return  # never fits, served uncached
+            self.entries[entry.key] = entry
+            self.total_bytes += entry.size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+
+    def discard(self, name: str):
+        with self.lock:
+            old = self.entries.pop(name, None)
+            if old is not None:
+                self.total_bytes -= old.size
+
+image_store = ImageStore(IMAGE_FOLDER, IMAGE_CACHE_BYTES)
+
+def parse_variant_args():
+    size = request.args.get("size", FULL_SIZE)
+    fmt = request.args.get("format", "png")
+    if size != FULL_SIZE and size not in VARIANT_SIZES:
+        abort(400, description=f"Unknown size '{size}'")
+    if fmt not in VARIANT_FORMATS:
+        abort(400, description=f"Unknown format '{fmt}'")
+    return size, fmt
 
 if os.path.exists(IMAGE_FOLDER):
+    image_store.preload()
     app.is_ready = True
 
 @app.route("/api/images", methods=["GET"])
@@ -15,24 +218,31 @@ def get_images_base64():
     if not names_param:
         return jsonify({"error": "Missing 'names' parameter"}), 400
 
-    requested_names = [name.strip() for name in names_param.split(",")]
-    images_data = {}
+    size, fmt = parse_variant_args()
+    requested_names = dict.fromkeys(name.strip() for name in names_param.split(","))
+    members = []
 
     for name in requested_names:
-        filepath = os.path.join(IMAGE_FOLDER, name+".png")
-        if not os.path.exists(filepath):
+        entry = image_store.get_variant(name, size, fmt)
+        if entry is None:
             continue  # Skip missing files
+        members.append(entry.json_member)
 
-        try:
-            with open(filepath, "rb") as img_file:
-                encoded = base64.b64encode(img_file.read()).decode("utf-8")
-                images_data.update({
-                    name: f"data:image/png;base64,{encoded}"
-                })
-        except Exception as e:
-            print(f"Failed to read {name}: {e}")
+    return Response("{" + ",".join(members) + "}", mimetype="application/json")
+
+@app.route("/api/images/<name>", methods=["GET"])
+def get_image_binary(name):
+    size, fmt = parse_variant_args()
+    entry = image_store.get_variant(name, size, fmt)
+    if entry is None:
+        abort(404)
 
-    return jsonify(images_data)
+    response = Response(entry.data, mimetype=entry.mimetype)
+    response.set_etag(entry.etag)  # strong etag over the content
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    # answers If-None-Match with 304 and Range with 206
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(entry.data))
 
 @app.route("/healthz")
 def healthz():
@@ -1,9 +1,13 @@
 import random
 import os
+import time
+import heapq
 import pickle
 import requests
 from flask import Flask, jsonify, request
-from threading import Lock
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from wal import GroupCommit, WriteAheadLog, FSYNC_ALWAYS
 
 app = Flask(__name__)
 app.is_ready = False
@@ -14,91 +18,512 @@ stocks: dict[str, int] = {}
 RESERVATIONS_FILE = "reservations.pkl"
 reservations = {}
 
-try:
-    if os.path.exists(STOCKS_FILE):
-        with open(STOCKS_FILE, "rb") as f:
-            stocks = pickle.load(f)
+# stocks.pkl/reservations.pkl are only read once to seed the first snapshot,
+# afterwards the state is SNAPSHOT_FILE plus the write-ahead log in WAL_DIR
+SNAPSHOT_FILE = "inventory.snapshot.pkl"
+WAL_DIR = os.environ.get("WAL_DIR", "wal")
+WAL_FSYNC = os.environ.get("WAL_FSYNC", FSYNC_ALWAYS)  # always | interval | never
+WAL_FSYNC_INTERVAL_MS = int(os.environ.get("WAL_FSYNC_INTERVAL_MS", 50))
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 60))  # seconds
+SNAPSHOT_EVERY = int(os.environ.get("SNAPSHOT_EVERY", 10000))  # records
+LOCK_STRIPES = int(os.environ.get("LOCK_STRIPES", 64))
+RESERVATION_TTL = float(os.environ.get("RESERVATION_TTL", 600))  # seconds an unconfirmed reservation holds stock, when it asked to expire
+SETTLED_RETENTION = float(os.environ.get("SETTLED_RETENTION", 3600))  # seconds settled reservations stay for idempotent retries
+SWEEP_INTERVAL = float(os.environ.get("SWEEP_INTERVAL", 1))
+SWEEP_BATCH = int(os.environ.get("SWEEP_BATCH", 500))
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("GROUP_COMMIT_WINDOW_MS", 2))  # how long the first record of a batch waits for company
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("GROUP_COMMIT_MAX_BATCH", 256))
+MAX_RESERVATION_BATCH = int(os.environ.get("MAX_RESERVATION_BATCH", 500))
+LOW_STOCK_THRESHOLD = int(os.environ.get("LOW_STOCK_THRESHOLD", 5))  # at or below this many left a product counts as low
+MAX_STOCK_IDS = int(os.environ.get("MAX_STOCK_IDS", 500))
+STOCK_MAX_AGE = int(os.environ.get("STOCK_MAX_AGE", 5))  # seconds clients may cache bulk stock answers
+CATEGORY_IDS_TTL = float(os.environ.get("CATEGORY_IDS_TTL", 60))
+# comma separated product ids whose stock is split into escrow partitions, e.g. flash-sale items
+HOT_PRODUCTS = [i for i in os.environ.get("HOT_PRODUCTS", "").split(",") if i]
+ESCROW_PARTITIONS = int(os.environ.get("ESCROW_PARTITIONS", 8))
+
+# reservation lifecycle: active -> confirmed | released | expired, the last three are settled
+ACTIVE = "active"
+SETTLED_STATUS = {"confirm": "confirmed", "release": "released", "expire": "expired"}
+
+class StripedLocks:
+    # A fixed pool of locks, keys map onto stripes by hash. Stripes are always
+    # taken in ascending order, so holders of overlapping sets cannot deadlock.
+    def __init__(self, count: int):
+        self.locks = [Lock() for _ in range(count)]
+
+    def stripes(self, keys) -> list[int]:
+        return sorted({hash(key) % len(self.locks) for key in keys})
+
+    @contextmanager
+    def hold(self, keys):
+        yield from self.hold_stripes(self.stripes(keys))
+
+    @contextmanager
+    def hold_all(self):
+        yield from self.hold_stripes(range(len(self.locks)))
+
+    def hold_stripes(self, stripes):
+        acquired = []
+        try:
+            for stripe in stripes:
+                self.locks[stripe].acquire()
+                acquired.append(stripe)
+            yield
+        finally:
+            for stripe in reversed(acquired):
+                self.locks[stripe].release()
+
+class Escrow:
+    # The stock of one hot product split over partitions with a lock each, so
+    # reservations of the same product only meet when they pick the same
+    # partition. A draw takes the whole quantity from one partition; when no
+    # single partition has room the stock is pooled and spread again with the
+    # drawn quantity taken out first. The partition sum is the stock, a draw
+    # never takes more than a partition holds, so nothing is oversold.
+    def __init__(self, stock: int, count: int):
+        self.parts = self.spread(stock, count)
+        self.locks = [Lock() for _ in range(count)]
+        self.rebalances = 0
+
+    @staticmethod
+    def spread(stock: int, count: int) -> list[int]:
+        return [stock // count + (1 if i < stock % count else 0) for i in range(count)]
+
+    def total(self) -> int:
+        return sum(self.parts)
+
+    def draw(self, qty: int) -> int | None:
+        # returns the partition the quantity came from, None when the stock is short
+        count = len(self.parts)
+        start = random.randrange(count)
+        for i in range(count):
+            partition = (start + i) % count
+            with self.locks[partition]:
+                if self.parts[partition] >= qty:
+                    self.parts[partition] -= qty
+                    return partition
+        return self.rebalance(start, qty)
+
+    def rebalance(self, partition: int, qty: int) -> int | None:
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            total = sum(self.parts)
+            if total < qty:
+                return None
+            self.parts[:] = self.spread(total - qty, len(self.parts))
+            self.rebalances += 1
+            return partition
+        finally:
+            for lock in reversed(self.locks):
+                lock.release()
+
+    def put_back(self, partition: int, qty: int):
+        partition %= len(self.parts)  # the partition count may differ from the one it was drawn under
+        with self.locks[partition]:
+            self.parts[partition] += qty
+
+# hot product id -> Escrow, built after recovery. Stock of these products
+# lives only in the escrow while running, stocks has no entry for them.
+escrows: dict[str, Escrow] = {}
+
+def stock_level(product_id: str) -> int:
+    escrow = escrows.get(product_id)
+    return stocks.get(product_id, 0) if escrow is None else escrow.total()
+
+def adjust_stock(product_id: str, delta: int, partition: int | None):
+    escrow = escrows.get(product_id)
+    if escrow is None:
+        stocks[product_id] = stocks.get(product_id, 0) + delta
     else:
-        # init stock randomly
-        counter = 5
-        while counter > 0:
-            try:
-                response = requests.get("http://product:5000/api/products")
-                response.raise_for_status()
-                products = response.json()
-                for p in products:
-                    id = str(p.get("id"))
-                    quantity = random.randint(0, 100)
-                    stocks[id] = quantity
-                break
-            except Exception:
-                counter -= 1
+        escrow.put_back(partition or 0, delta)
+
+def stripe_keys(reservation_id: str, product_ids) -> list[str]:
+    # hot products are guarded by their escrow partitions, not by stripes
+    return [reservation_key(reservation_id), *(p for p in product_ids if p not in escrows)]
+
+# product ids and "reservation:<id>" keys share the stripes, so retries of the
+# same reservation serialize with each other as well as with their products
+locks = StripedLocks(LOCK_STRIPES)
+
+def reservation_key(reservation_id: str) -> str:
+    return f"reservation:{reservation_id}"
+
+wal = WriteAheadLog(WAL_DIR, WAL_FSYNC, WAL_FSYNC_INTERVAL_MS)
+group = GroupCommit(wal, GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH)
+last_snapshot_seq = 0
+snapshot_needed = Event()
+
+# min-heaps of (deadline, reservation_id) driving the sweeper, entries are
+# checked against the reservation when popped so stale ones are just skipped
+expiry_heap: list[tuple[float, str]] = []
+settled_heap: list[tuple[float, str]] = []
+timers_lock = Lock()
+
+def schedule(reservation_id: str, reservation: dict):
+    with timers_lock:
+        if reservation["status"] == ACTIVE:
+            if reservation["expires_at"] is not None:
+                heapq.heappush(expiry_heap, (reservation["expires_at"], reservation_id))
+        else:
+            heapq.heappush(settled_heap, (reservation["settled_at"] + SETTLED_RETENTION, reservation_id))
+
+def apply_record(record: dict):
+    # the only place stock and reservations change, used live and on replay
+    if record["op"] == "reserve":
+        partitions = record.get("partitions", {})
+        for product_id, qty in zip(record["product_ids"], record["quantities"]):
+            # a live draw already took it out of the escrow, on replay there are no escrows yet
+            if product_id in partitions and product_id in escrows:
                 continue
-        # Save initial state
-        with open(STOCKS_FILE, "wb") as f:
-            pickle.dump(stocks, f)
+            adjust_stock(product_id, -qty, None)
+        reservation = {
+            "product_ids": record["product_ids"],
+            "quantities": record["quantities"],
+            "partitions": partitions,
+            "status": ACTIVE,
+            "expires_at": record["expires_at"]
+        }
+        reservations[record["reservation_id"]] = reservation
+    elif record["op"] in SETTLED_STATUS:
+        reservation = reservations.get(record["reservation_id"])
+        if reservation is None or reservation["status"] != ACTIVE:
+            return  # already settled and compacted away before the snapshot
+        if record["op"] != "confirm":
+            # escrow stock goes back to the partition it was drawn from
+            partitions = reservation.get("partitions", {})
+            for product_id, qty in zip(reservation["product_ids"], reservation["quantities"]):
+                adjust_stock(product_id, qty, partitions.get(product_id))
+        reservation["status"] = SETTLED_STATUS[record["op"]]
+        reservation["settled_at"] = record["at"]
+    else:
+        return
+    schedule(record["reservation_id"], reservation)
+
+def commit(records: list[dict]) -> int:
+    # caller holds the stripes of every key the records touch. They are applied
+    # right away and queued for the next group commit, the caller has to
+    # group.wait() on the returned ticket, after dropping its stripes, before
+    # acknowledging anything
+    for record in records:
+        apply_record(record)
+    ticket = group.submit(records)
+    if wal.seq - last_snapshot_seq >= SNAPSHOT_EVERY:
+        snapshot_needed.set()
+    return ticket
+
+def settle(reservation_id: str, op: str, wait: bool = True) -> dict | None:
+    # moves an active reservation to the settled state op leads to, returns
+    # it, or None when it is unknown or not active any more
+    reservation = reservations.get(reservation_id)
+    if reservation is None:
+        return None
+    with locks.hold(stripe_keys(reservation_id, reservation["product_ids"])):
+        if reservation["status"] != ACTIVE:
+            return None
+        ticket = commit([{"op": op, "reservation_id": reservation_id, "at": time.time()}])
+    if wait:
+        group.wait(ticket)
+    return reservation
+
+def pop_due(heap: list[tuple[float, str]], now: float) -> list[str]:
+    due = []
+    with timers_lock:
+        while heap and heap[0][0] <= now and len(due) < SWEEP_BATCH:
+            due.append(heapq.heappop(heap)[1])
+    return due
 
-    if os.path.exists(STOCKS_FILE):
-        with open(STOCKS_FILE, "rb") as f:
-            reservations = pickle.load(f)
+def sweep():
+    now = time.time()
+    # give expired reservations back to stock
+    while due := pop_due(expiry_heap, now):
+        for reservation_id in due:
+            reservation = reservations.get(reservation_id)
+            if reservation is not None and reservation["status"] == ACTIVE \
+                    and reservation["expires_at"] is not None and reservation["expires_at"] <= now:
+                settle(reservation_id, "expire", wait=False)
+    # forget settled reservations once the retry window is over
+    while due := pop_due(settled_heap, now):
+        for reservation_id in due:
+            with locks.hold([reservation_key(reservation_id)]):
+                reservation = reservations.get(reservation_id)
+                if reservation is not None and reservation["status"] != ACTIVE \
+                        and reservation["settled_at"] + SETTLED_RETENTION <= now:
+                    del reservations[reservation_id]
+
+def sweep_loop():
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        try:
+            sweep()
+        except Exception as e:
+            print(f"Sweep failed: {e}")
+
+def take_snapshot():
+    global last_snapshot_seq
+    with locks.hold_all():
+        # nothing can be queued while every stripe is held, write out what is
+        # so the snapshot and its seq agree
+        group.flush()
+        seq = wal.checkpoint()
+        # every reservation path holds its reservation stripe, so the escrows are still too
+        state_stocks = {**stocks, **{product_id: escrow.total() for product_id, escrow in escrows.items()}}
+        state_bytes = pickle.dumps({"seq": seq, "stocks": state_stocks, "reservations": reservations})
+    wal.compact(SNAPSHOT_FILE, state_bytes, seq)
+    last_snapshot_seq = seq
+
+def snapshot_loop():
+    while True:
+        snapshot_needed.wait(timeout=SNAPSHOT_INTERVAL)
+        snapshot_needed.clear()
+        if wal.seq != last_snapshot_seq:
+            try:
+                take_snapshot()
+            except Exception as e:
+                print(f"Snapshot failed: {e}")
+
+try:
+    if os.path.exists(SNAPSHOT_FILE):
+        with open(SNAPSHOT_FILE, "rb") as f:
+            state = pickle.load(f)
+        stocks = state["stocks"]
+        reservations = state["reservations"]
+        last_snapshot_seq = state["seq"]
     else:
-        with open(STOCKS_FILE, "wb") as f:
-            pickle.dump(reservations, f)
-    
+        if os.path.exists(STOCKS_FILE):
+            with open(STOCKS_FILE, "rb") as f:
+                stocks = pickle.load(f)
+        else:
+            # init stock randomly
+            counter = 5
+            while counter > 0:
+                try:
+                    response = requests.get("http://product:5000/api/products")
+                    response.raise_for_status()
+                    products = response.json()
+                    for p in products:
+                        id = str(p.get("id"))
+                        quantity = random.randint(0, 100)
+                        stocks[id] = quantity
+                    break
+                except Exception:
+                    counter -= 1
+                    continue
+
+        if os.path.exists(RESERVATIONS_FILE):
+            with open(RESERVATIONS_FILE, "rb") as f:
+                # older builds saved the stocks into this file, keep only the reservations
+                reservations = {k: v for k, v in pickle.load(f).items() if isinstance(v, dict)}
+
+    # Reservations from before expiry existed never expire: back then an
+    # active reservation meant a placed order, stock only came back when the
+    # payment failed and the workflow released it.
+    for reservation_id, reservation in reservations.items():
+        if reservation["status"] == ACTIVE:
+            reservation.setdefault("expires_at", None)
+        else:
+            reservation.setdefault("settled_at", time.time())
+        schedule(reservation_id, reservation)
+
+    for record in wal.replay(last_snapshot_seq):
+        apply_record(record)
+    wal.open()
+    group.start()
+
+    for product_id in HOT_PRODUCTS:
+        escrows[product_id] = Escrow(stocks.pop(product_id, 0), ESCROW_PARTITIONS)
+
+    if not os.path.exists(SNAPSHOT_FILE):
+        take_snapshot()
+    Thread(target=snapshot_loop, daemon=True).start()
+    Thread(target=sweep_loop, daemon=True).start()
+
     app.is_ready = True
-except:
+except Exception as e:
+    print(f"Failed to recover inventory state: {e}")
     app.is_ready = False
-    
-lock = Lock()
 
 @app.route("/api/inventory/<product_id>", methods=["GET"])
 def get_stock(product_id):
-    with lock:
-        stock = stocks.get(product_id, 0)
+    stock = stock_level(product_id)
     return jsonify({"product_id": product_id, "stock": stock})
 
-@app.route("/api/inventory/check_and_reserve", methods=["POST"])
-def check_and_reserve():
-    data = request.get_json()
+def parse_reservation(data) -> tuple[dict | None, str | None]:
+    # validates one reservation request, returns it with its summed demand or an error
+    if not isinstance(data, dict):
+        return None, "reservation must be an object"
     product_ids = data.get("product_ids")
     quantities = data.get("quantities")
     reservation_id = data.get("reservation_id")
 
     if not reservation_id:
-        return jsonify({"error": "reservation_id is required"}), 400
+        return None, "reservation_id is required"
 
     if not isinstance(product_ids, list) or not isinstance(quantities, list):
-        return jsonify({"error": "product_ids and quantities must be lists"}), 400
-    
+        return None, "product_ids and quantities must be lists"
+
     if len(product_ids) != len(quantities):
-        return jsonify({"error": "product_ids and quantities must be the same length"}), 400
-
-    with lock:
-        if reservation_id in reservations:
-            # Already reserved — idempotent success
-            return jsonify({"success": True, "reserved": reservations[reservation_id]}), 200
-        # Check availability
-        for product_id, quantity in zip(product_ids, quantities):
-            if stocks.get(product_id, 0) < quantity:
-                return jsonify({"success": False, "product_id": product_id, "available": stocks.get(product_id, 0)}), 500
-
-        # Reserve stock
-        for product_id, qty in zip(product_ids, quantities):
-            stocks[product_id] -= qty
-
-        reservations[reservation_id] = {
-            "product_ids": product_ids,
-            "quantities": quantities,
-            "status": "active"
-        }
+        return None, "product_ids and quantities must be the same length"
+
+    for quantity in quantities:
+        # bool is an int too, negative quantities would add stock
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            return None, f"quantities must be positive integers, got {quantity!r}"
+
+    # a product may appear on several lines, check against the summed demand
+    demand: dict[str, int] = {}
+    for product_id, quantity in zip(product_ids, quantities):
+        demand[product_id] = demand.get(product_id, 0) + quantity
+
+    # only clients that confirm ask for expiry, older ones release or keep
+    # the stock like before and must not lose it to the sweeper
+    expires = data.get("expires", False) is True
+
+    return {"reservation_id": reservation_id, "product_ids": product_ids, "quantities": quantities, "demand": demand,
+            "expires": expires}, None
+
+def try_reserve(parsed: dict, now: float) -> tuple[dict, int, int | None]:
+    # caller holds the stripes of the reservation and its products, returns
+    # the response body, status and the ticket of the new record if any
+    reservation_id = parsed["reservation_id"]
+    if reservation_id in reservations:
+        reservation = reservations[reservation_id]
+        if reservation["status"] in (SETTLED_STATUS["release"], SETTLED_STATUS["expire"]):
+            return {"error": f"Reservation {reservation_id} was already {reservation['status']}"}, 409, None
+        # Already reserved — idempotent success
+        return {"success": True, "reserved": reservation}, 200, None
+    # Check availability
+    for product_id, quantity in parsed["demand"].items():
+        if product_id not in escrows and stocks.get(product_id, 0) < quantity:
+            return {"success": False, "product_id": product_id, "available": stocks.get(product_id, 0)}, 500, None
+    # hot products draw from their escrow, undo the earlier draws if a later one is short
+    partitions = {}
+    for product_id, quantity in parsed["demand"].items():
+        if product_id not in escrows:
+            continue
+        partition = escrows[product_id].draw(quantity)
+        if partition is None:
+            for drawn_id, drawn in partitions.items():
+                escrows[drawn_id].put_back(drawn, parsed["demand"][drawn_id])
+            return {"success": False, "product_id": product_id, "available": stock_level(product_id)}, 500, None
+        partitions[product_id] = partition
+
+    # Reserve stock
+    ticket = commit([{
+        "op": "reserve",
+        "reservation_id": reservation_id,
+        "product_ids": parsed["product_ids"],
+        "quantities": parsed["quantities"],
+        "partitions": partitions,
+        "expires_at": now + RESERVATION_TTL if parsed["expires"] else None
+    }])
+    return {"success": True, "reserved": dict(zip(parsed["product_ids"], parsed["quantities"]))}, 200, ticket
+
+def wait_durable(ticket: int | None):
+    # without a new record the answer may still rest on a record that is
+    # queued but not written yet, so wait for everything queued so far
+    if ticket is None:
+        group.sync()
+    else:
+        group.wait(ticket)
+
+# availability buckets for the bulk read, exact counts stay internal
+IN_STOCK = "in_stock"
+LOW_STOCK = "low_stock"
+OUT_OF_STOCK = "out_of_stock"
+
+def availability(stock: int) -> str:
+    if stock <= 0:
+        return OUT_OF_STOCK
+    if stock <= LOW_STOCK_THRESHOLD:
+        return LOW_STOCK
+    return IN_STOCK
+
+# category id -> (fetched at, product ids), membership rarely changes
+category_ids_cache: dict[str, tuple[float, list[str]]] = {}
+
+def get_category_product_ids(category_id: str) -> list[str] | None:
+    cached = category_ids_cache.get(category_id)
+    if cached and time.time() - cached[0] < CATEGORY_IDS_TTL:
+        return cached[1]
+    try:
+        response = requests.get(f"http://product:5000/api/categories/{category_id}/products", timeout=2)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        ids = [str(p.get("id")) for p in response.json()]
+    except Exception:
+        # serve the stale list rather than nothing
+        return cached[1] if cached else None
+    category_ids_cache[category_id] = (time.time(), ids)
+    return ids
 
-        with open(STOCKS_FILE, "wb") as f:
-            pickle.dump(stocks, f)
+@app.route("/api/inventory/stock", methods=["GET"])
+def get_stock_bulk():
+    # ?ids=1,2,3 or ?category_id=4. Reads take no stripes, every product is
+    # read on its own so the answer is current per product, not one snapshot.
+    category_id = request.args.get("category_id")
+    if category_id is not None:
+        product_ids = get_category_product_ids(category_id)
+        if product_ids is None:
+            return jsonify({"error": f"Category {category_id} not found"}), 404
+    else:
+        product_ids = [i for i in request.args.get("ids", "").split(",") if i]
+        if not product_ids:
+            return jsonify({"error": "ids or category_id is required"}), 400
+        if len(product_ids) > MAX_STOCK_IDS:
+            return jsonify({"error": f"at most {MAX_STOCK_IDS} ids per request"}), 400
+
+    response = jsonify({"availability": {product_id: availability(stock_level(product_id)) for product_id in product_ids}})
+    response.headers["Cache-Control"] = f"max-age={STOCK_MAX_AGE}"
+    return response, 200
+
+@app.route("/api/inventory/check_and_reserve", methods=["POST"])
+def check_and_reserve():
+    parsed, error = parse_reservation(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
 
-        with open(RESERVATIONS_FILE, "wb") as f:
-            pickle.dump(reservations, f)
+    with locks.hold(stripe_keys(parsed["reservation_id"], parsed["demand"])):
+        body, status, ticket = try_reserve(parsed, time.time())
+    wait_durable(ticket)
 
-    return jsonify({"success": True, "reserved": dict(zip(product_ids, quantities))}), 200
+    return jsonify(body), status
+
+@app.route("/api/inventory/check_and_reserve_batch", methods=["POST"])
+def check_and_reserve_batch():
+    # independent reservations in one call, each gets its own result in
+    # request order, and all of them share one durable write
+    data = request.get_json()
+    batch = data.get("reservations") if isinstance(data, dict) else None
+    if not isinstance(batch, list):
+        return jsonify({"error": "reservations must be a list"}), 400
+    if len(batch) > MAX_RESERVATION_BATCH:
+        return jsonify({"error": f"at most {MAX_RESERVATION_BATCH} reservations per batch"}), 400
+
+    results: list[dict | None] = [None] * len(batch)
+    valid = []
+    keys = set()
+    for i, item in enumerate(batch):
+        parsed, error = parse_reservation(item)
+        if error:
+            results[i] = {"status": 400, "reservation_id": item.get("reservation_id") if isinstance(item, dict) else None, "error": error}
+            continue
+        valid.append((i, parsed))
+        keys.update(stripe_keys(parsed["reservation_id"], parsed["demand"]))
+
+    # tickets grow in submit order, waiting for the last covers the batch
+    ticket = None
+    now = time.time()
+    with locks.hold(keys):
+        for i, parsed in valid:
+            body, status, new_ticket = try_reserve(parsed, now)
+            results[i] = {"status": status, "reservation_id": parsed["reservation_id"], **body}
+            ticket = new_ticket or ticket
+    wait_durable(ticket)
+
+    return jsonify({"results": results}), 200
 
 @app.route("/api/inventory/release", methods=["POST"])
 def release_stock():
@@ -108,38 +533,52 @@ def release_stock():
     if not reservation_id:
         return jsonify({"error": "reservation_id is required"}), 400
 
-    with lock:
-        reservation = reservations.get(reservation_id)
-        if not reservation or reservation["status"] == "released":
-            return jsonify({"success": True, "message": "Already released or unknown"}), 200
-        
-        for product_id, qty in zip(reservation["product_ids"], reservation["quantities"]):
-            stocks[product_id] = stocks.get(product_id, 0) + qty
+    reservation = settle(reservation_id, "release")
+    if reservation is None:
+        group.sync()  # the settling record may still be queued
+        current = reservations.get(reservation_id)
+        if current is not None and current["status"] == SETTLED_STATUS["confirm"]:
+            return jsonify({"error": "Reservation is already confirmed"}), 409
+        return jsonify({"success": True, "message": "Already released or unknown"}), 200
 
-        reservation["status"] = "released"
+    return jsonify({"success": True, "restored": reservation}), 200
 
-        with open(STOCKS_FILE, "wb") as f:
-            pickle.dump(stocks, f)
+@app.route("/api/inventory/confirm", methods=["POST"])
+def confirm_stock():
+    data = request.get_json()
+    reservation_id = data.get("reservation_id")
 
-        with open(RESERVATIONS_FILE, "wb") as f:
-            pickle.dump(reservations, f)
+    if not reservation_id:
+        return jsonify({"error": "reservation_id is required"}), 400
 
-    return jsonify({"success": True, "restored": reservation}), 200
+    # the stock stays taken for good and the reservation no longer expires
+    reservation = settle(reservation_id, "confirm")
+    if reservation is None:
+        group.sync()
+        current = reservations.get(reservation_id)
+        if current is not None and current["status"] == SETTLED_STATUS["confirm"]:
+            return jsonify({"success": True, "confirmed": current}), 200
+        if current is None:
+            return jsonify({"error": "Unknown reservation"}), 404
+        return jsonify({"error": f"Reservation was already {current['status']}"}), 409
+
+    return jsonify({"success": True, "confirmed": reservation}), 200
+
+@app.route("/api/inventory/metrics")
+def metrics():
+    return jsonify({
+        "group_commit": group.metrics(),
+        "wal_seq": wal.seq,
+        "escrows": {product_id: {"partitions": escrow.parts, "rebalances": escrow.rebalances} for product_id, escrow in escrows.items()}
+    }), 200
 
 @app.route("/healthz")
 def healthz():
-    if lock.acquire(timeout=2):  # try for 1 second
-        try:
-            return jsonify(status="alive"), 200
-        finally:
-            lock.release()
-    else:
-        return jsonify(status="locked"), 500
+    return jsonify(status="alive"), 200
 
 @app.route("/ready")
 def ready():
     if not app.is_ready:
         return jsonify(status="not ready"), 503
     else:
-        with lock:
-            return jsonify(status="ready"), 200
\ No newline at end of file
+        return jsonify(status="ready"), 200
\ No newline at end of file
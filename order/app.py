@@ -1,8 +1,12 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from datetime import datetime
 import os
+import json
+import zlib
 import pickle
-from threading import Lock
+from bisect import bisect_left, insort
+from threading import Event, Lock, Thread
+from wal import GroupCommit, WriteAheadLog, FSYNC_ALWAYS
 
 app = Flask(__name__)
 app.is_ready = False
@@ -57,51 +61,242 @@ class Order:
 ORDER_FILE = "orders.pkl"
 ITEMS_FILE = "items.pkl"
 
-try:
-    if os.path.exists(ORDER_FILE):
-        with open(ORDER_FILE, "rb") as f:
-            orders = pickle.load(f)
+# orders.pkl/items.pkl only seed the first snapshot, afterwards the state is
+# SNAPSHOT_FILE plus the write-ahead log in WAL_DIR
+SNAPSHOT_FILE = "orders.snapshot.pkl"
+WAL_DIR = os.environ.get("WAL_DIR", "wal")
+# always: a write is acknowledged once fsynced, concurrent writes share the fsync
+# interval: fsync every WAL_FSYNC_INTERVAL_MS, a crash can lose that window
+WAL_FSYNC = os.environ.get("WAL_FSYNC", FSYNC_ALWAYS)
+WAL_FSYNC_INTERVAL_MS = int(os.environ.get("WAL_FSYNC_INTERVAL_MS", 50))
+# no extra wait by default, writes arriving during an fsync already form the next batch
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("GROUP_COMMIT_WINDOW_MS", 0))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("GROUP_COMMIT_MAX_BATCH", 256))
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 300))  # seconds
+SNAPSHOT_EVERY = int(os.environ.get("SNAPSHOT_EVERY", 100000))  # records
+DEFAULT_CHANGES_LIMIT = 1000
+MAX_CHANGES_LIMIT = 10000
+EXPORT_CHUNK_ROWS = 500  # rows per streamed chunk
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", 10000))
+MAX_ORDERS_LIMIT = 100
+
+ORDER_FIELDS = [
+    "id", "user_id", "total_price_in_cents", "address_name", "address1", "address2",
+    "credit_card_company", "credit_card_number", "credit_card_expiry", "shipping_workflow_id"
+]
+ITEM_FIELDS = ["id", "product_id", "order_id", "quantity"]
+
+wal = WriteAheadLog(WAL_DIR, WAL_FSYNC, WAL_FSYNC_INTERVAL_MS)
+group = GroupCommit(wal, GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH)
+last_snapshot_seq = 0
+snapshot_needed = Event()
+
+# indexes over orders and order_items, only changed together with the lists under lock
+orders_by_id: dict[str, Order] = {}
+order_ids_by_user: dict[str, list[str]] = {}  # sorted by order time, oldest first
+items_by_id: dict[str, OrderItem] = {}
+item_ids_by_order: dict[str, list[str]] = {}
+
+def index_order(order: Order):
+    orders_by_id[order.id] = order
+    user_order_ids = order_ids_by_user.setdefault(order.user_id, [])
+    if user_order_ids and orders_by_id[user_order_ids[-1]].time > order.time:
+        insort(user_order_ids, order.id, key=lambda order_id: orders_by_id[order_id].time)
     else:
-        orders = [
-            Order("1", "1", datetime.now().isoformat(), 12499, "Alice Smith", "123 Main St", "Apt 4", "Visa", "4111111111111111", "12/25", "1234"),
-            Order("2", "2", datetime.now().isoformat(), 12499, "Bob Jones", "123 Main St", "Apt 4", "Visa", "4111111111111111", "12/25", "1234")
-        ]
-
-        # Save initial state
-        with open(ORDER_FILE, "wb") as f:
-            pickle.dump(orders, f)
-
-    # Load persisted data if available
-    if os.path.exists(ITEMS_FILE):
-        with open(ITEMS_FILE, "rb") as f:
-            order_items = pickle.load(f)
+        user_order_ids.append(order.id)  # the usual case, a new order is the newest
+
+def index_item(item: OrderItem):
+    items_by_id[item.id] = item
+    item_ids_by_order.setdefault(item.order_id, []).append(item.id)
+
+def apply_record(record: dict):
+    # the only place orders and items change, used live (under lock) and on replay
+    if record["op"] == "order":
+        order = Order(**record["order"])
+        orders.append(order)
+        index_order(order)
+    elif record["op"] == "item":
+        item = OrderItem(**record["item"])
+        order_items.append(item)
+        index_item(item)
+    elif record["op"] == "order_with_items":
+        # one record, so an order never comes back from a crash without its items
+        apply_record({"op": "order", "order": record["order"]})
+        apply_record({"op": "items", "items": record["items"]})
+    elif record["op"] == "items":
+        for fields in record["items"]:
+            item = OrderItem(**fields)
+            order_items.append(item)
+            index_item(item)
+    elif record["op"] == "shipping_done":
+        order = orders_by_id.get(record["order_id"])
+        if order is not None:
+            order.shipping_done = record["shipping_done"]
+
+def commit(record: dict) -> int:
+    # caller holds lock, group.wait() on the ticket after releasing it and before answering
+    apply_record(record)
+    ticket = group.submit([record])
+    if wal.seq - last_snapshot_seq >= SNAPSHOT_EVERY:
+        snapshot_needed.set()
+    return ticket
+
+def wait_durable(ticket: int | None):
+    # an answer without a new record may rest on one that is still queued
+    if ticket is None:
+        group.sync()
     else:
-        order_items = [
-            OrderItem("1", "1", "1", 1),
-            OrderItem("2", "2", "1", 1),
-            OrderItem("3", "2", "2", 1),
-            OrderItem("4", "3", "2", 1),
-            OrderItem("5", "5", "2", 3),
-            OrderItem("6", "6", "2", 2),
-            OrderItem("7", "7", "2", 3),
-            OrderItem("8", "8", "2", 1),
-        ]
-
-        # Save initial state
-        with open(ITEMS_FILE, "wb") as f:
-            pickle.dump(order_items, f)
+        group.wait(ticket)
 
-    app.is_ready = True
-except:
-    app.is_ready = False
+def missing_field(data, fields) -> str | None:
+    if not isinstance(data, dict):
+        return "body must be an object"
+    for field in fields:
+        if field not in data:
+            return f"Missing field: {field}"
+    return None
+
+def invalid_int(data, field) -> str | None:
+    # checked before taking the lock, order_fields/item_fields convert without checking
+    try:
+        int(data[field])
+    except (TypeError, ValueError):
+        return f"Invalid {field}: {data[field]!r}"
+    return None
+
+def order_fields(data) -> dict:
+    return {
+        "id": data["id"],
+        "user_id": data["user_id"],
+        "time": datetime.now().isoformat(),
+        "total_price_in_cents": int(data["total_price_in_cents"]),
+        "address_name": data["address_name"],
+        "address1": data["address1"],
+        "address2": data["address2"],
+        "credit_card_company": data["credit_card_company"],
+        "credit_card_number": data["credit_card_number"],
+        "credit_card_expiry": data["credit_card_expiry"],
+        "shipping_workflow_id": data["shipping_workflow_id"]
+    }
+
+def item_fields(data) -> dict:
+    return {
+        "id": data["id"],
+        "product_id": data["product_id"],
+        "order_id": data["order_id"],
+        "quantity": int(data["quantity"])
+    }
+
+def take_snapshot():
+    global last_snapshot_seq
+    with lock:
+        group.flush()
+        seq = wal.checkpoint()
+        # shallow copies are enough, later changes to shipping_done are in records after seq
+        state = {"seq": seq, "orders": list(orders), "order_items": list(order_items)}
+    wal.compact(SNAPSHOT_FILE, pickle.dumps(state), seq)
+    last_snapshot_seq = seq
+
+def snapshot_loop():
+    while True:
+        snapshot_needed.wait(timeout=SNAPSHOT_INTERVAL)
+        snapshot_needed.clear()
+        if wal.seq != last_snapshot_seq:
+            try:
+                take_snapshot()
+            except Exception as e:
+                print(f"Snapshot failed: {e}")
 
 lock = Lock()
 
+try:
+    if os.path.exists(SNAPSHOT_FILE):
+        with open(SNAPSHOT_FILE, "rb") as f:
+            state = pickle.load(f)
+        orders = state["orders"]
+        order_items = state["order_items"]
+        last_snapshot_seq = state["seq"]
+    else:
+        if os.path.exists(ORDER_FILE):
+            with open(ORDER_FILE, "rb") as f:
+                orders = pickle.load(f)
+        else:
+            orders = [
+                Order("1", "1", datetime.now().isoformat(), 12499, "Alice Smith", "123 Main St", "Apt 4", "Visa", "4111111111111111", "12/25", "1234"),
+                Order("2", "2", datetime.now().isoformat(), 12499, "Bob Jones", "123 Main St", "Apt 4", "Visa", "4111111111111111", "12/25", "1234")
+            ]
+
+            # Save initial state
+            with open(ORDER_FILE, "wb") as f:
+                pickle.dump(orders, f)
+
+        # Load persisted data if available
+        if os.path.exists(ITEMS_FILE):
+            with open(ITEMS_FILE, "rb") as f:
+                order_items = pickle.load(f)
+        else:
+            order_items = [
+                OrderItem("1", "1", "1", 1),
+                OrderItem("2", "2", "1", 1),
+                OrderItem("3", "2", "2", 1),
+                OrderItem("4", "3", "2", 1),
+                OrderItem("5", "5", "2", 3),
+                OrderItem("6", "6", "2", 2),
+                OrderItem("7", "7", "2", 3),
+                OrderItem("8", "8", "2", 1),
+            ]
+
+            # Save initial state
+            with open(ITEMS_FILE, "wb") as f:
+                pickle.dump(order_items, f)
+
+    for order in sorted(orders, key=lambda o: o.time):
+        index_order(order)
+    for item in order_items:
+        index_item(item)
+
+    for record in wal.replay(last_snapshot_seq):
+        apply_record(record)
+    wal.open()
+    group.start()
+
+    if not os.path.exists(SNAPSHOT_FILE):
+        take_snapshot()
+    Thread(target=snapshot_loop, daemon=True).start()
+
+    app.is_ready = True
+except Exception as e:
+    print(f"Failed to recover order state: {e}")
+    app.is_ready = False
+
 @app.route("/api/orders/<user_id>", methods=["GET"])
 def get_orders_by_user(user_id):
+    if "limit" not in request.args and "before" not in request.args:
+        with lock:
+            user_orders = [orders_by_id[order_id].to_dict() for order_id in order_ids_by_user.get(user_id, [])]
+        return jsonify(user_orders)
+
+    # paged form, newest first: {"orders": [...], "next_before": order id or null}.
+    # before is the id of the last order of the previous page.
+    limit = request.args.get("limit", MAX_ORDERS_LIMIT, type=int)
+    before = request.args.get("before")
+    if not 0 < limit <= MAX_ORDERS_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {MAX_ORDERS_LIMIT}"}), 400
+
     with lock:
-        user_orders = [order.to_dict() for order in orders if order.user_id == user_id]
-    return jsonify(user_orders)
+        user_order_ids = order_ids_by_user.get(user_id, [])
+        end = len(user_order_ids)
+        if before is not None:
+            cursor = orders_by_id.get(before)
+            if cursor is None or cursor.user_id != user_id:
+                return jsonify({"error": f"Unknown order {before}"}), 400
+            # the list is sorted by time, find the cursor among orders with the same time
+            end = bisect_left(user_order_ids, cursor.time, key=lambda order_id: orders_by_id[order_id].time)
+            while user_order_ids[end] != before:
+                end += 1
+        start = max(0, end - limit)
+        page = [orders_by_id[order_id].to_dict() for order_id in reversed(user_order_ids[start:end])]
+    return jsonify({"orders": page, "next_before": page[-1]["id"] if start > 0 else None})
 
 @app.route("/api/orderitems", methods=["GET"])
 def get_order_items():
@@ -109,6 +304,100 @@ def get_order_items():
         items = [item.to_dict() for item in order_items]
     return jsonify(items)
 
+@app.route("/api/orderitems/changes", methods=["GET"])
+def get_order_item_changes():
+    # order_items is append-only and replay keeps its order, so an item's seq
+    # is its position + 1 and stays the same across restarts. Returns items
+    # with seq > since and the watermark to pass as since next time.
+    since = request.args.get("since", 0, type=int)
+    limit = request.args.get("limit", DEFAULT_CHANGES_LIMIT, type=int)
+    if since < 0 or not 0 < limit <= MAX_CHANGES_LIMIT:
+        return jsonify({"error": f"since must be >= 0 and limit between 1 and {MAX_CHANGES_LIMIT}"}), 400
+
+    with lock:
+        end = len(order_items)
+    # everything up to end was queued before we looked, only hand out durable items
+    group.sync()
+    end = min(end, since + limit)
+    changes = []
+    for seq in range(since + 1, end + 1):
+        item = order_items[seq - 1].to_dict()
+        item["seq"] = seq
+        changes.append(item)
+    return jsonify({"items": changes, "next": max(since, end)})
+
+def export_filters():
+    # ?from=&to= bound the order time (iso strings compare in time order), plus ?user_id= and ?product_id=
+    return {
+        "start": request.args.get("from"),
+        "end": request.args.get("to"),
+        "user_id": request.args.get("user_id"),
+        "product_id": request.args.get("product_id"),
+    }
+
+def export_orders(start, end, user_id, product_id):
+    # Walks the append-only lists by position without holding the lock between
+    # rows, so writers are not blocked and nothing is copied. Rows appended
+    # after the export started are not included.
+    with lock:
+        order_ids = list(order_ids_by_user.get(user_id, [])) if user_id is not None else None
+        count = len(orders)
+    candidates = (orders_by_id[i] for i in order_ids) if order_ids is not None else (orders[i] for i in range(count))
+    for order in candidates:
+        if (start and order.time < start) or (end and order.time >= end):
+            continue
+        if product_id is not None and not any(items_by_id[i].product_id == product_id for i in item_ids_by_order.get(order.id, ())):
+            continue
+        yield order.to_dict()
+
+def export_order_items(start, end, user_id, product_id):
+    if user_id is not None:
+        with lock:
+            item_ids = [i for order_id in order_ids_by_user.get(user_id, []) for i in item_ids_by_order.get(order_id, [])]
+        candidates = (items_by_id[i] for i in item_ids)
+    else:
+        with lock:
+            count = len(order_items)
+        candidates = (order_items[i] for i in range(count))
+    for item in candidates:
+        if product_id is not None and item.product_id != product_id:
+            continue
+        if start or end:
+            order = orders_by_id.get(item.order_id)
+            if order is None or (start and order.time < start) or (end and order.time >= end):
+                continue
+        yield item.to_dict()
+
+def ndjson_response(rows):
+    # one json object per line, sent in chunks as they are produced, gzipped
+    # when the client accepts it
+    use_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+
+    def chunks():
+        compressor = zlib.compressobj(wbits=31) if use_gzip else None  # 31: gzip container
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(row))
+            if len(lines) >= EXPORT_CHUNK_ROWS:
+                data = ("\n".join(lines) + "\n").encode("utf-8")
+                lines = []
+                yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else data
+        data = ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+        yield compressor.compress(data) + compressor.flush() if compressor else data
+
+    response = Response(chunks(), mimetype="application/x-ndjson")
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+@app.route("/api/export/orders", methods=["GET"])
+def export_orders_ndjson():
+    return ndjson_response(export_orders(**export_filters()))
+
+@app.route("/api/export/orderitems", methods=["GET"])
+def export_order_items_ndjson():
+    return ndjson_response(export_order_items(**export_filters()))
+
 @app.route("/api/orders/<order_id>/shipping_done", methods=["POST"])
 def update_shipping_done(order_id):
     data = request.get_json()
@@ -117,67 +406,126 @@ def update_shipping_done(order_id):
 
     # Look up the order
     with lock:
-        for order in orders:
-            if order.id == order_id:
-                order.shipping_done = bool(data["shipping_done"])
-                return jsonify(order.to_dict()), 200
+        order = orders_by_id.get(order_id)
+        if order is None:
+            return jsonify({"error": "Order not found"}), 404
+        ticket = commit({"op": "shipping_done", "order_id": order_id, "shipping_done": bool(data["shipping_done"])})
+        body = order.to_dict()
+    group.wait(ticket)
 
-    return jsonify({"error": "Order not found"}), 404
+    return jsonify(body), 200
 
 @app.route("/api/orders", methods=["POST"])
 def create_order():
     data = request.get_json()
 
-    required_fields = [
-        "id", "user_id", "total_price_in_cents", "address_name", "address1", "address2",
-        "credit_card_company", "credit_card_number", "credit_card_expiry", "shipping_workflow_id"
-    ]
-    for field in required_fields:
+    for field in ORDER_FIELDS:
         if field not in data:
             return jsonify({"error": f"Missing required field: {field}"}), 400
     with lock:
-        if any(order.id == data["id"] for order in orders):
+        if data["id"] in orders_by_id:
             return jsonify({"error": "Order ID already exists"}), 409
 
-        order = Order(
-            id=data["id"],
-            user_id=data["user_id"],
-            time=datetime.now().isoformat(),
-            total_price_in_cents=data["total_price_in_cents"],
-            address_name=data["address_name"],
-            address1=data["address1"],
-            address2=data["address2"],
-            credit_card_company=data["credit_card_company"],
-            credit_card_number=data["credit_card_number"],
-            credit_card_expiry=data["credit_card_expiry"],
-            shipping_workflow_id=data["shipping_workflow_id"]
-        )
-        orders.append(order)
+        ticket = commit({"op": "order", "order": order_fields(data)})
+    group.wait(ticket)
 
     return jsonify({"success": "Order created."}), 201
 
+@app.route("/api/orders/with_items", methods=["POST"])
+def create_order_with_items():
+    # The order plus {"items": [{"id", "product_id", "quantity"}, ...]} in one
+    # durable record. Item ids are idempotency keys: a retry gets 409 with the
+    # same per-item results, items missing from an earlier partial attempt
+    # are added, an item id used by another order fails the whole request.
+    data = request.get_json()
+    error = missing_field(data, ORDER_FIELDS) or invalid_int(data, "total_price_in_cents")
+    if error:
+        return jsonify({"error": error}), 400
+    items = data.get("items")
+    if not isinstance(items, list) or len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"items must be a list of at most {MAX_BATCH_ITEMS} items"}), 400
+    for item in items:
+        error = missing_field(item, ["id", "product_id", "quantity"]) or invalid_int(item, "quantity")
+        if error:
+            return jsonify({"error": error, "id": item.get("id") if isinstance(item, dict) else None}), 400
+
+    order_id = data["id"]
+    with lock:
+        order_exists = order_id in orders_by_id
+        results = []
+        new_items = []
+        seen = set()
+        for item in items:
+            current = items_by_id.get(item["id"])
+            if current is not None and current.order_id != order_id:
+                return jsonify({"error": f"OrderItem ID {item['id']} already exists for another order"}), 409
+            if current is not None or item["id"] in seen:
+                results.append({"id": item["id"], "status": 409})
+                continue
+            seen.add(item["id"])
+            new_items.append(item_fields({**item, "order_id": order_id}))
+            results.append({"id": item["id"], "status": 201})
+
+        if not order_exists:
+            ticket = commit({"op": "order_with_items", "order": order_fields(data), "items": new_items})
+        elif new_items:
+            ticket = commit({"op": "items", "items": new_items})
+        else:
+            ticket = None
+    wait_durable(ticket)
+
+    if order_exists and not new_items:
+        return jsonify({"error": "Order ID already exists", "items": results}), 409
+    return jsonify({"success": "Order created." if not order_exists else "Order completed.", "items": results}), 201
+
 @app.route("/api/orderitems", methods=["POST"])
 def create_order_item():
     data = request.get_json()
 
-    required_fields = ["id", "product_id", "order_id", "quantity"]
-    for field in required_fields:
+    for field in ITEM_FIELDS:
         if field not in data:
             return jsonify({"error": f"Missing field: {field}"}), 400
+    error = invalid_int(data, "quantity")
+    if error:
+        return jsonify({"error": error}), 400
 
     with lock:
-        if any(item.id == data["id"] for item in order_items):
+        if data["id"] in items_by_id:
             return jsonify({"error": "OrderItem ID already exists"}), 409
 
-        item = OrderItem(
-            id=data["id"],
-            product_id=data["product_id"],
-            order_id=data["order_id"],
-            quantity=data["quantity"]
-        )
-        order_items.append(item)
+        ticket = commit({"op": "item", "item": item_fields(data)})
+        item = items_by_id[data["id"]]
+    group.wait(ticket)
     return jsonify(item.to_dict()), 200
 
+@app.route("/api/orderitems/batch", methods=["POST"])
+def create_order_items_batch():
+    # {"items": [...]} for backfills, one durable record, a result per item in
+    # request order with the status the single POST would have returned
+    data = request.get_json()
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"items must be a list of at most {MAX_BATCH_ITEMS} items"}), 400
+
+    with lock:
+        results = []
+        new_items = []
+        seen = set()
+        for item in items:
+            error = missing_field(item, ITEM_FIELDS) or invalid_int(item, "quantity")
+            if error:
+                results.append({"id": item.get("id") if isinstance(item, dict) else None, "status": 400, "error": error})
+            elif item["id"] in items_by_id or item["id"] in seen:
+                results.append({"id": item["id"], "status": 409, "error": "OrderItem ID already exists"})
+            else:
+                seen.add(item["id"])
+                new_items.append(item_fields(item))
+                results.append({"id": item["id"], "status": 200})
+        ticket = commit({"op": "items", "items": new_items}) if new_items else None
+    wait_durable(ticket)
+
+    return jsonify({"results": results}), 200
+
 @app.route("/healthz")
 def healthz():
     if lock.acquire(timeout=1):  # try for 1 second
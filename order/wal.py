@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import fcntl
+from threading import Condition, Lock, Thread
+
+# fsync policies
+FSYNC_ALWAYS = "always"      # fsync before a write is acknowledged
+FSYNC_INTERVAL = "interval"  # background fsync every interval_ms, may lose that window on a crash
+FSYNC_NEVER = "never"        # leave it to the OS page cache
+
+class WriteAheadLog:
+    # Append-only log of JSON lines split into segments named by the first
+    # sequence number they hold. A snapshot covers everything up to its seq;
+    # compact() writes one and deletes the segments it made redundant.
+
+    def __init__(self, directory: str, fsync_policy: str = FSYNC_ALWAYS, fsync_interval_ms: int = 50):
+        if fsync_policy not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.directory = directory
+        self.fsync_policy = fsync_policy
+        self.fsync_interval_ms = fsync_interval_ms
+        self.seq = 0
+        self.file = None
+        self.dirty = False
+        self.lock_file = None
+        self.lock = Lock()  # guards file handle and seq, callers keep their own state lock
+        os.makedirs(directory, exist_ok=True)
+
+    def segment_path(self, first_seq: int) -> str:
+        return os.path.join(self.directory, f"{first_seq:020d}.log")
+
+    def segments(self) -> list[tuple[int, str]]:
+        found = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".log"):
+                found.append((int(filename[:-len(".log")]), os.path.join(self.directory, filename)))
+        return sorted(found)
+
+    def acquire(self):
+        # one writer per directory: a second process would reuse seqs and
+        # compact away the segment the first one is appending to
+        if self.lock_file is not None:
+            return
+        lock_file = open(os.path.join(self.directory, "LOCK"), "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(f"{self.directory} is locked by another process")
+        self.lock_file = lock_file
+
+    def replay(self, after_seq: int):
+        # yields records with seq > after_seq, stops at the first torn or corrupt line
+        self.acquire()
+        self.seq = after_seq
+        for _, path in self.segments():
+            with open(path, "rb") as f:
+                valid_bytes = 0
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("torn write")
+                        record = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        print(f"Truncating {path} after {valid_bytes} bytes")
+                        break
+                    valid_bytes += len(line)
+                    if record["seq"] > self.seq:
+                        self.seq = record["seq"]
+                        yield record
+            if valid_bytes != os.path.getsize(path):
+                with open(path, "r+b") as f:
+                    f.truncate(valid_bytes)
+                return
+
+    def open(self):
+        # start a fresh segment after recovery, older segments stay until compaction
+        self.acquire()
+        with self.lock:
+            self.rotate()
+        if self.fsync_policy == FSYNC_INTERVAL:
+            Thread(target=self.fsync_loop, daemon=True).start()
+
+    def rotate(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        self.file = open(self.segment_path(self.seq + 1), "ab")
+
+    def checkpoint(self) -> int:
+        # seal the current segment so a snapshot taken now can drop everything before it
+        with self.lock:
+            self.rotate()
+            return self.seq
+
+    def append(self, record: dict) -> int:
+        return self.append_many([record])
+
+    def append_many(self, records: list[dict]) -> int:
+        # one write (and at most one fsync) for the whole batch, returns the last seq
+        with self.lock:
+            lines = []
+            for record in records:
+                self.seq += 1
+                record["seq"] = self.seq
+                lines.append(json.dumps(record, separators=(",", ":")))
+            self.file.write(("\n".join(lines) + "\n").encode("utf-8"))
+            self.file.flush()
+            if self.fsync_policy == FSYNC_ALWAYS:
+                os.fsync(self.file.fileno())
+            else:
+                self.dirty = True
+            return self.seq
+
+    def fsync_loop(self):
+        while True:
+            time.sleep(self.fsync_interval_ms / 1000)
+            with self.lock:
+                if self.dirty:
+                    os.fsync(self.file.fileno())
+                    self.dirty = False
+
+    def compact(self, snapshot_path: str, state_bytes: bytes, snapshot_seq: int):
+        # state_bytes must reflect exactly the records up to snapshot_seq
+        tmp_path = snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(state_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+
+        # a segment is redundant once the next one starts at or before snapshot_seq + 1
+        segments = self.segments()
+        for (_, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first <= snapshot_seq + 1:
+                os.remove(path)
+
+class GroupCommit:
+    # Batches records from concurrent writers into one WAL append. Writers
+    # apply a record in memory while holding their own locks, submit() it and
+    # get a ticket back, drop their locks and wait() for the ticket before
+    # answering. A single flusher waits up to window_ms for more records after
+    # the first one arrives (or until max_batch are queued), writes them all
+    # with append_many and wakes every writer at once, so the fsync is paid
+    # per batch instead of per request. Records reach the log in submit order,
+    # which is the order writers applied them under their locks.
+
+    def __init__(self, wal: WriteAheadLog, window_ms: float = 2, max_batch: int = 256):
+        self.wal = wal
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.queue: list[dict] = []
+        self.queued_at = 0.0
+        self.submitted = 0  # ticket of the last submitted record
+        self.durable = 0  # ticket of the last record written to the log
+        self.error = None  # set once a write failed, memory is ahead of the log from then on
+        self.cond = Condition()
+        self.flush_lock = Lock()  # one append_many at a time so batches keep their order
+        # metrics
+        self.batches = 0
+        self.records = 0
+        self.max_batch_size = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def start(self):
+        Thread(target=self.run, daemon=True).start()
+
+    def submit(self, records: list[dict]) -> int:
+        with self.cond:
+            if not self.queue:
+                self.queued_at = time.monotonic()
+            self.queue.extend(records)
+            self.submitted += len(records)
+            self.cond.notify_all()
+            return self.submitted
+
+    def wait(self, ticket: int):
+        with self.cond:
+            while self.durable < ticket:
+                if self.error is not None:
+                    raise IOError(f"Write-ahead log failed: {self.error}")
+                self.cond.wait()
+
+    def sync(self):
+        # waits until everything submitted so far is durable
+        with self.cond:
+            ticket = self.submitted
+        self.wait(ticket)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.cond:
+                batch, self.queue = self.queue, []
+                waited = time.monotonic() - self.queued_at
+            if not batch:
+                return
+            try:
+                self.wal.append_many(batch)
+            except Exception as e:
+                with self.cond:
+                    self.error = e
+                    self.cond.notify_all()
+                raise
+            with self.cond:
+                self.durable += len(batch)
+                self.batches += 1
+                self.records += len(batch)
+                self.max_batch_size = max(self.max_batch_size, len(batch))
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                deadline = self.queued_at + self.window_ms / 1000
+                while len(self.queue) < self.max_batch and (remaining := deadline - time.monotonic()) > 0:
+                    self.cond.wait(remaining)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Group commit failed: {e}")
+                return
+
+    def metrics(self) -> dict:
+        with self.cond:
+            return {
+                "window_ms": self.window_ms,
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "records": self.records,
+                "queued": len(self.queue),
+                "avg_batch_size": self.records / self.batches if self.batches else 0,
+                "max_batch_size": self.max_batch_size,
+                "avg_wait_ms": self.total_wait * 1000 / self.batches if self.batches else 0,
+                "max_wait_ms": self.max_wait * 1000
+            }
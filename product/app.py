@@ -1,7 +1,10 @@
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort
 from threading import Lock
 import os
+import json
 import pickle
+import hashlib
+from search import SearchIndex
 
 app = Flask(__name__)
 app.is_ready = False
@@ -126,45 +129,148 @@ try:
 except:
     app.is_ready = False
 
-lock = Lock()
+SORT_KEYS = {
+    "price": lambda p: (p.price_in_cents, p.name.lower()),
+    "name": lambda p: p.name.lower(),
+}
+MAX_PAGE_SIZE = 100
+MAX_RESPONSE_CACHE_SIZE = 1024
 
-def find_by_id(items, id):
-    return next((item for item in items if item.id == id), None)
+class CatalogSnapshot:
+    # Immutable view of the catalog: lists, indexes, search index and the
+    # serialized responses built from them. Readers grab the current snapshot
+    # once per request and never lock; writers build a new one and swap it in.
+    def __init__(self, version: int, categories: list[Category], products: list[Product], search_index: SearchIndex):
+        self.version = version
+        self.categories = categories
+        self.products = products
+        self.search_index = search_index
+        self.categories_by_id = {c.id: c for c in categories}
+        self.products_by_id = {p.id: p for p in products}
+        self.product_ids_by_category: dict[str, list[str]] = {c.id: [] for c in categories}
+        for p in products:
+            self.product_ids_by_category.setdefault(p.category_id, []).append(p.id)
+        self.sorted_product_ids_by_category = {
+            sort: {
+                category_id: sorted(ids, key=lambda p_id: key(self.products_by_id[p_id]))
+                for category_id, ids in self.product_ids_by_category.items()
+            }
+            for sort, key in SORT_KEYS.items()
+        }
+        # serialized bodies are only valid for this version, filled lazily by readers
+        self.response_cache: dict[str, tuple[bytes, str]] = {}
+
+catalog = CatalogSnapshot(0, [], [], SearchIndex())
+write_lock = Lock()  # serializes writers only
+
+def set_catalog(new_categories: list[Category], new_products: list[Product]):
+    global catalog
+    with write_lock:
+        current = catalog
+        search_index = updated_search_index(current, new_products)
+        catalog = CatalogSnapshot(current.version + 1, new_categories, new_products, search_index)
+
+def updated_search_index(current: CatalogSnapshot, new_products: list[Product]) -> SearchIndex:
+    if len(current.search_index) == 0:
+        search_index = SearchIndex()
+        search_index.build([(p.id, p.name, p.description) for p in new_products])
+        return search_index
+    # copy-on-write clone, only products whose searchable text changed are touched
+    search_index = current.search_index.copy()
+    new_ids = set()
+    for p in new_products:
+        new_ids.add(p.id)
+        old = current.products_by_id.get(p.id)
+        if old is None or old.name != p.name or old.description != p.description:
+            search_index.add(p.id, p.name, p.description)
+    for id in current.products_by_id.keys() - new_ids:
+        search_index.remove(id)
+    return search_index
+
+# serve the json body for key from the snapshot's cache, build() produces it on a miss
+def cached_json_response(snapshot: CatalogSnapshot, key, build):
+    cached = snapshot.response_cache.get(key)
+    if cached is None:
+        body = json.dumps(build(), separators=(",", ":")).encode("utf-8")
+        cached = (body, hashlib.sha256(body).hexdigest())
+        if len(snapshot.response_cache) < MAX_RESPONSE_CACHE_SIZE:
+            snapshot.response_cache[key] = cached
+
+    body, etag = cached
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["X-Catalog-Version"] = str(snapshot.version)
+    return response.make_conditional(request)
+
+if app.is_ready:
+    set_catalog(categories, products)
 
 @app.route("/api/categories", methods=["GET"])
 def get_categories():
-    return jsonify([c.to_dict() for c in categories])
+    snapshot = catalog
+    return cached_json_response(snapshot, "categories", lambda: [c.to_dict() for c in snapshot.categories])
 
 @app.route("/api/products", methods=["GET"])
 def get_products():
-    with lock:
-        result = [p.to_dict() for p in products]
-    return jsonify(result)
+    snapshot = catalog
+    return cached_json_response(snapshot, "products", lambda: [p.to_dict() for p in snapshot.products])
 
 @app.route("/api/categories/<id>", methods=["GET"])
 def get_category(id):
-    with lock:
-        category = find_by_id(categories, id)
-
+    category = catalog.categories_by_id.get(id)
     if category:
         return jsonify(category.to_dict())
     abort(404)
 
 @app.route("/api/categories/<id>/products", methods=["GET"])
 def get_products_by_category(id):
-    with lock:
-        matched_category = find_by_id(categories, id)
-
-    if not matched_category:
+    snapshot = catalog
+    if id not in snapshot.categories_by_id:
         abort(404, description=f"Category with id {id} not found.")
-    with lock:
-        filtered_products = [p.to_dict() for p in products if p.category_id == id]
-    return jsonify(filtered_products)
+
+    sort = request.args.get("sort")
+    if sort is not None and sort not in SORT_KEYS:
+        abort(400, description=f"'sort' must be one of {', '.join(SORT_KEYS)}")
+    if "offset" not in request.args and "limit" not in request.args and sort is None:
+        return cached_json_response(
+            snapshot,
+            f"categories/{id}/products",
+            lambda: [snapshot.products_by_id[p_id].to_dict() for p_id in snapshot.product_ids_by_category.get(id, [])]
+        )
+
+    # paged form: {"products": [...], "total_count": n, "offset": o, "limit": l}
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", MAX_PAGE_SIZE, type=int)
+    if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        abort(400, description=f"'offset' must be >= 0 and 'limit' between 1 and {MAX_PAGE_SIZE}")
+
+    def build_page():
+        ids = (snapshot.sorted_product_ids_by_category[sort] if sort else snapshot.product_ids_by_category).get(id, [])
+        return {
+            "products": [snapshot.products_by_id[p_id].to_dict() for p_id in ids[offset:offset + limit]],
+            "total_count": len(ids),
+            "offset": offset,
+            "limit": limit,
+        }
+    return cached_json_response(snapshot, f"categories/{id}/products?sort={sort}&offset={offset}&limit={limit}", build_page)
+
+@app.route("/api/products/search", methods=["GET"])
+def search_products():
+    query = request.args.get("q", "")
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", 20, type=int)
+    prefix = request.args.get("prefix", "true").lower() != "false"
+    if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        abort(400, description=f"'offset' must be >= 0 and 'limit' between 1 and {MAX_PAGE_SIZE}")
+
+    snapshot = catalog
+    hits = snapshot.search_index.search(query, k=offset + limit, prefix=prefix)[offset:]
+    result = [dict(snapshot.products_by_id[id].to_dict(), score=round(score, 4)) for id, score in hits]
+    return jsonify({"query": query, "products": result, "offset": offset, "limit": limit})
 
 @app.route("/api/products/<id>", methods=["GET"])
 def get_product(id):
-    with lock:
-        product = find_by_id(products, id)
+    product = catalog.products_by_id.get(id)
     if product:
         return jsonify(product.to_dict())
     abort(404)
@@ -176,25 +282,21 @@ def get_products_bulk():
         abort(400, description="Missing 'ids' in request body")
 
     ids = data["ids"]
+    if not isinstance(ids, list):
+        abort(400, description="'ids' must be a list")
 
-    with lock:
-        result = [p.to_dict() for p in products if p.id in ids]
+    # unique ids in the order they were requested, unknown ids are skipped
+    products_by_id = catalog.products_by_id
+    result = [products_by_id[id].to_dict() for id in dict.fromkeys(map(str, ids)) if id in products_by_id]
     return jsonify(result)
 
 @app.route("/healthz")
 def healthz():
-    if lock.acquire(timeout=1):  # try for 1 second
-        try:
-            return jsonify(status="alive"), 200
-        finally:
-            lock.release()
-    else:
-        return jsonify(status="locked"), 500
+    return jsonify(status="alive", catalog_version=catalog.version), 200
 
 @app.route("/ready")
 def ready():
     if not app.is_ready:
         return jsonify(status="not ready"), 503
     else:
-        with lock:
-            return jsonify(status="ready"), 200
\ No newline at end of file
+        return jsonify(status="ready"), 200
\ No newline at end of file
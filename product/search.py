@@ -0,0 +1,220 @@
+import re
+import math
+import heapq
+import operator
+import unicodedata
+from bisect import bisect_left, insort
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+NAME_BOOST = 2  # a name token counts as this many description tokens
+MAX_PREFIX_EXPANSIONS = 32
+
+def normalize(text: str) -> str:
+    # lowercase and strip accents so "Rooïbos" matches "rooibos"
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(normalize(text))
+
+class SearchIndex:
+    # Inverted index over product name and description with BM25 ranking.
+    #
+    # Every term keeps its postings twice: a dict doc_id -> weight for random
+    # access, and a list of (-weight, doc_id) sorted best first. Single-token
+    # queries run the threshold algorithm over the sorted lists and stop as soon
+    # as no unseen document can enter the top k, so a common term costs about
+    # O(k), not O(df). Multi-token queries score only the intersection of the
+    # token postings.
+    # The weight is the tf/length part of BM25. It uses an average document
+    # length frozen at the last build() so the sorted order stays valid under
+    # incremental add/remove.
+
+    def __init__(self):
+        self.weights: dict[str, dict[str, float]] = {}
+        self.impacts: dict[str, list[tuple[float, str]]] = {}
+        self.terms: list[str] = []  # sorted vocabulary for prefix lookups
+        self.doc_terms: dict[str, dict[str, int]] = {}
+        self.avgdl = 1.0
+        self.owned: set[str] | None = None  # terms whose postings this copy may mutate, None means all
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def term_frequencies(self, name: str, description: str) -> dict[str, int]:
+        tf: dict[str, int] = {}
+        for token in tokenize(name):
+            tf[token] = tf.get(token, 0) + NAME_BOOST
+        for token in tokenize(description):
+            tf[token] = tf.get(token, 0) + 1
+        return tf
+
+    def weight(self, tf: int, dl: int) -> float:
+        return tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / self.avgdl))
+
+    def copy(self) -> "SearchIndex":
+        # Copy-on-write clone: the outer maps are copied, per-term postings are
+        # shared until add/remove first touches them, so the original stays
+        # untouched for readers still using it.
+        clone = SearchIndex()
+        clone.weights = dict(self.weights)
+        clone.impacts = dict(self.impacts)
+        clone.terms = list(self.terms)
+        clone.doc_terms = dict(self.doc_terms)
+        clone.avgdl = self.avgdl
+        clone.owned = set()
+        return clone
+
+    def own(self, term: str):
+        if self.owned is None or term in self.owned:
+            return
+        self.weights[term] = dict(self.weights[term])
+        self.impacts[term] = list(self.impacts[term])
+        self.owned.add(term)
+
+    def build(self, docs: list[tuple[str, str, str]]):
+        # docs are (doc_id, name, description), replaces the whole index
+        doc_terms = {doc_id: self.term_frequencies(name, description) for doc_id, name, description in docs}
+        total = sum(sum(tf.values()) for tf in doc_terms.values())
+        self.avgdl = total / len(doc_terms) if doc_terms else 1.0
+
+        weights: dict[str, dict[str, float]] = {}
+        for doc_id, tf in doc_terms.items():
+            dl = sum(tf.values())
+            for term, count in tf.items():
+                weights.setdefault(term, {})[doc_id] = self.weight(count, dl)
+
+        self.doc_terms = doc_terms
+        self.weights = weights
+        self.impacts = {term: sorted((-w, doc_id) for doc_id, w in postings.items()) for term, postings in weights.items()}
+        self.terms = sorted(weights)
+        self.owned = None
+
+    def add(self, doc_id: str, name: str, description: str):
+        if doc_id in self.doc_terms:
+            self.remove(doc_id)
+        tf = self.term_frequencies(name, description)
+        dl = sum(tf.values())
+        self.doc_terms[doc_id] = tf
+        for term, count in tf.items():
+            w = self.weight(count, dl)
+            if term not in self.weights:
+                self.weights[term] = {}
+                self.impacts[term] = []
+                insort(self.terms, term)
+                if self.owned is not None:
+                    self.owned.add(term)
+            else:
+                self.own(term)
+            self.weights[term][doc_id] = w
+            insort(self.impacts[term], (-w, doc_id))
+
+    def remove(self, doc_id: str):
+        tf = self.doc_terms.pop(doc_id, None)
+        if tf is None:
+            return
+        for term in tf:
+            self.own(term)
+            w = self.weights[term].pop(doc_id)
+            impacts = self.impacts[term]
+            del impacts[bisect_left(impacts, (-w, doc_id))]
+            if not impacts:
+                del self.weights[term]
+                del self.impacts[term]
+                del self.terms[bisect_left(self.terms, term)]
+
+    def expand_prefix(self, prefix: str) -> list[str]:
+        # the MAX_PREFIX_EXPANSIONS terms with the prefix found in the most
+        # documents, so a short prefix keeps the common words instead of the
+        # alphabetically first ones
+        start = bisect_left(self.terms, prefix)
+        end = bisect_left(self.terms, prefix + "\U0010ffff", start)
+        matching = self.terms[start:end]
+        if len(matching) <= MAX_PREFIX_EXPANSIONS:
+            return matching
+        return heapq.nlargest(MAX_PREFIX_EXPANSIONS, matching, key=lambda term: len(self.weights[term]))
+
+    def idf(self, term: str) -> float:
+        n = len(self.doc_terms)
+        df = len(self.weights[term])
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 20, prefix: bool = True) -> list[tuple[str, float]]:
+        # Returns up to k (doc_id, score) pairs, best first. Every query token
+        # has to match; with prefix the last token matches any term starting
+        # with it, which is what autocomplete needs. A token expanded to several
+        # terms scores as its best matching term, each term's idf scaled by its
+        # share of the expansions' documents: the user is more likely typing a
+        # common word than a rare one, which plain idf would rank first.
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or k <= 0:
+            return []
+        slots = [[t] if t in self.weights else [] for t in tokens[:-1]]
+        slots.append(self.expand_prefix(tokens[-1]) if prefix else [t for t in tokens[-1:] if t in self.weights])
+        if not all(slots):
+            return []
+        slot_lists = [[(self.idf(t), self.weights[t]) for t in terms] for terms in slots]
+        if len(slots[-1]) > 1:
+            total_df = sum(len(w) for _, w in slot_lists[-1])
+            slot_lists[-1] = [(idf * len(w) / total_df, w) for idf, w in slot_lists[-1]]
+
+        if len(slots) == 1:
+            return self.top_k([(idf, self.impacts[t]) for t, (idf, _) in zip(slots[0], slot_lists[0])], slot_lists[0], k)
+
+        # intersect from the rarest token so the work is bounded by its postings
+        keys = []
+        for lists in slot_lists:
+            if len(lists) == 1:
+                keys.append(lists[0][1].keys())
+            else:
+                keys.append(set().union(*(w.keys() for _, w in lists)))
+        keys.sort(key=len)
+        candidates = keys[0] & keys[1]
+        for other in keys[2:]:
+            candidates = {doc_id for doc_id in candidates if doc_id in other}
+
+        # score slot by slot so the inner loops stay in comprehensions
+        candidates = list(candidates)
+        totals = [0.0] * len(candidates)
+        for lists in slot_lists:
+            if len(lists) == 1:
+                idf, w = lists[0]
+                column = [idf * w[doc_id] for doc_id in candidates]
+            else:
+                column = [max(i * w.get(doc_id, 0.0) for i, w in lists) for doc_id in candidates]
+            totals = list(map(operator.add, totals, column))
+        return [(doc_id, score) for score, doc_id in heapq.nlargest(k, zip(totals, candidates))]
+
+    def top_k(self, ranked: list[tuple[float, list[tuple[float, str]]]], lists: list[tuple[float, dict[str, float]]], k: int) -> list[tuple[str, float]]:
+        # Threshold algorithm over the impact lists of the terms one token
+        # expanded to. After each row no unseen document can score above the
+        # best value in that row, so we stop once the k-th score reaches it.
+        top: list[tuple[float, str]] = []  # min-heap of the best k
+        seen = set()
+        depth = 0
+        while True:
+            threshold = 0.0
+            exhausted = True
+            for idf, impacts in ranked:
+                if depth >= len(impacts):
+                    continue
+                exhausted = False
+                neg_w, doc_id = impacts[depth]
+                threshold = max(threshold, idf * -neg_w)
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                score = max(i * w.get(doc_id, 0.0) for i, w in lists)
+                if len(top) < k:
+                    heapq.heappush(top, (score, doc_id))
+                elif score > top[0][0]:
+                    heapq.heapreplace(top, (score, doc_id))
+            if exhausted or (len(top) == k and top[0][0] >= threshold):
+                break
+            depth += 1
+
+        return [(doc_id, score) for score, doc_id in sorted(top, reverse=True)]
@@ -1,11 +1,31 @@
 from flask import Flask, jsonify, request
 import os
+import heapq
 import pickle
-from threading import Lock
+import requests
+from array import array
+from threading import Event, Lock, Thread
+
+try:
+    import cooccurrence
+except ImportError:  # without numpy/scipy every page gets the popularity ranking
+    cooccurrence = None
 
 app = Flask(__name__)
 
 DATA_FILE = "recommendations.pkl"
+# running popularity counters plus the change-feed watermark they include
+STATE_FILE = "recommender_state.pkl"
+# the (order, product) pairs behind the co-occurrence table, one pickled chunk appended per refresh
+PAIRS_FILE = "recommender_pairs.pkl"
+# the last co-occurrence table and the number of pairs it was built from
+NEIGHBORS_FILE = "recommender_neighbors.pkl"
+TOP_K = int(os.environ.get("TOP_K", 100))  # ranked products kept, the most "num" can ask for
+CHANGES_PAGE_SIZE = 1000
+NEIGHBORS = int(os.environ.get("NEIGHBORS", 20))  # co-ordered products kept per product
+MAX_SEED_PRODUCTS = 50  # cart products looked up per request
+REBUILD_INTERVAL = float(os.environ.get("REBUILD_INTERVAL", 300))  # seconds between co-occurrence rebuilds
+REBUILD_MIN_PAIRS = int(os.environ.get("REBUILD_MIN_PAIRS", 10000))  # new pairs that start a rebuild early
 
 if os.path.exists(DATA_FILE):
     with open(DATA_FILE, "rb") as f:
@@ -15,10 +35,166 @@ else:
     with open(DATA_FILE, "wb") as f:
         pickle.dump(recommendations, f)
 
+counts: dict[str, int] = {}
+top: list[str] = []  # the TOP_K most ordered products, best first
+watermark = 0  # seq of the last order item counted
+# every (order, product) pair seen, as dense indexes for the co-occurrence build;
+# all of these only grow, and only under refresh_lock
+product_ids: list[str] = []
+product_index: dict[str, int] = {}
+order_ids: list[str] = []
+order_index: dict[str, int] = {}
+pair_orders = array("i")
+pair_products = array("i")
+pairs_bytes = 0  # length of PAIRS_FILE the state covers
+saved_products = saved_orders = saved_pairs = 0  # entries already in PAIRS_FILE
+# product id -> [(product id, orders holding both)], replaced whole on rebuild
+neighbors: dict[str, list[tuple[str, int]]] = {}
+built_pairs = 0  # pairs the current table was built from
+rebuild_needed = Event()
+
+if os.path.exists(STATE_FILE):
+    with open(STATE_FILE, "rb") as f:
+        state = pickle.load(f)
+    # a state without pairs_bytes predates the pairs file, dropping it replays
+    # the whole change feed on the next refresh
+    if "pairs_bytes" in state:
+        counts = state["counts"]
+        top = state["top"]
+        watermark = state["watermark"]
+        pairs_bytes = state["pairs_bytes"]
+        recommendations = list(top)
+
+if os.path.exists(PAIRS_FILE):
+    with open(PAIRS_FILE, "r+b") as f:
+        # chunks past pairs_bytes come from a refresh whose state was never saved
+        f.truncate(pairs_bytes)
+        while f.tell() < pairs_bytes:
+            new_products, new_orders, chunk_orders, chunk_products = pickle.load(f)
+            product_ids += new_products
+            order_ids += new_orders
+            pair_orders += chunk_orders
+            pair_products += chunk_products
+    product_index = {p_id: i for i, p_id in enumerate(product_ids)}
+    order_index = {o_id: i for i, o_id in enumerate(order_ids)}
+    saved_products, saved_orders, saved_pairs = len(product_ids), len(order_ids), len(pair_orders)
+
+if os.path.exists(NEIGHBORS_FILE):
+    with open(NEIGHBORS_FILE, "rb") as f:
+        neighbors, built_pairs = pickle.load(f)
+    if built_pairs > len(pair_orders):
+        # built from pairs that were dropped with an older state
+        neighbors, built_pairs = {}, 0
+
 lock = Lock()
+refresh_lock = Lock()  # one refresh at a time, readers only need lock
+
+def save_pairs():
+    # appends only what was added since the last call, the state saved after
+    # it records the new length
+    global pairs_bytes, saved_products, saved_orders, saved_pairs
+    chunk = (product_ids[saved_products:], order_ids[saved_orders:], pair_orders[saved_pairs:], pair_products[saved_pairs:])
+    with open(PAIRS_FILE, "r+b" if os.path.exists(PAIRS_FILE) else "wb") as f:
+        f.seek(pairs_bytes)
+        pickle.dump(chunk, f)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+        pairs_bytes = f.tell()
+    saved_products, saved_orders, saved_pairs = len(product_ids), len(order_ids), len(pair_orders)
+
+def save_state():
+    tmp_path = STATE_FILE + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"counts": counts, "top": top, "watermark": watermark, "pairs_bytes": pairs_bytes}, f)
+    os.replace(tmp_path, STATE_FILE)
+
+def rank(candidates) -> list[str]:
+    # most ordered first, ties by product id so the order is stable
+    return [p_id for _, p_id in heapq.nsmallest(TOP_K, ((-counts[p_id], p_id) for p_id in set(candidates)))]
+
+def apply_items(items: list[dict]) -> set[str]:
+    touched = set()
+    for item in items:
+        p_id = item.get("product_id")
+        counts[p_id] = counts.get(p_id, 0) + item.get("quantity", 1)
+        touched.add(p_id)
+        if p_id not in product_index:
+            product_index[p_id] = len(product_ids)
+            product_ids.append(p_id)
+        o_id = item.get("order_id")
+        if o_id not in order_index:
+            order_index[o_id] = len(order_ids)
+            order_ids.append(o_id)
+        pair_orders.append(order_index[o_id])
+        pair_products.append(product_index[p_id])
+    return touched
+
+def rebuild_neighbors():
+    # Builds from a copy of the pairs so refreshes are only blocked for the
+    # copy, not for the matrix product; readers keep the old table until the
+    # new one is swapped in.
+    global neighbors, built_pairs
+    with refresh_lock:
+        num_pairs = len(pair_orders)
+        num_products = len(product_ids)
+        orders, products = pair_orders[:num_pairs], pair_products[:num_pairs]
+    indptr, cols, co_counts = cooccurrence.build_neighbors(orders, products, num_products, NEIGHBORS)
+    indptr, cols, co_counts = indptr.tolist(), cols.tolist(), co_counts.tolist()
+    table = {}
+    for i in range(num_products):
+        start, end = indptr[i], indptr[i + 1]
+        if start < end:
+            table[product_ids[i]] = [(product_ids[j], c) for j, c in zip(cols[start:end], co_counts[start:end])]
+
+    tmp_path = NEIGHBORS_FILE + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump((table, num_pairs), f)
+    os.replace(tmp_path, NEIGHBORS_FILE)
+    neighbors, built_pairs = table, num_pairs
+
+def rebuild_loop():
+    while True:
+        rebuild_needed.wait(timeout=REBUILD_INTERVAL)
+        rebuild_needed.clear()
+        if len(pair_orders) != built_pairs:
+            try:
+                rebuild_neighbors()
+            except Exception as e:
+                print(f"Co-occurrence rebuild failed: {e}")
+
+if cooccurrence is not None:
+    if len(pair_orders) != built_pairs:
+        rebuild_needed.set()
+    Thread(target=rebuild_loop, daemon=True).start()
+
+def also_bought(seeds: list[str], num: int) -> list[str]:
+    # sums the precomputed neighbor counts of the seeds, so the work is
+    # bounded by len(seeds) * NEIGHBORS whatever the number of orders
+    table = neighbors
+    scores = {}
+    for seed in seeds:
+        for p_id, count in table.get(seed, ()):
+            scores[p_id] = scores.get(p_id, 0) + count
+    exclude = set(seeds)
+    ranked = [p_id for _, p_id in heapq.nsmallest(num + len(exclude), ((-count, p_id) for p_id, count in scores.items()))]
+    recommended = [p_id for p_id in ranked if p_id not in exclude][:num]
+    if len(recommended) < num:
+        # not enough co-orders yet, top up with the most ordered products
+        with lock:
+            popular = list(recommendations)
+        chosen = exclude | set(recommended)
+        recommended += [p_id for p_id in popular if p_id not in chosen][:num - len(recommended)]
+    return recommended
 
 @app.route("/api/recommendations", methods=["GET"])
 def get_recommendations():
+    # ?product_id= and ?cart=id,id,... ask for products ordered together with those
+    seeds = request.args.getlist("product_id") or [p_id for p_id in request.args.get("cart", "").split(",") if p_id]
+    if seeds:
+        num = max(0, min(request.args.get("num", 3, type=int), TOP_K))
+        return jsonify(also_bought(seeds[:MAX_SEED_PRODUCTS], num))
+
     with lock:
         num_recommendations = min(request.args.get("num", 3, type=int), len(recommendations))
         recommended = recommendations[:num_recommendations]
@@ -38,3 +214,41 @@ def set_recommendations():
             pickle.dump(recommendations, f)
 
     return jsonify({"success": True, "count": len(recommendations)}), 200
+
+@app.route("/api/recommendations/refresh", methods=["POST"])
+def refresh_recommendations():
+    # Pulls only the order items added since the watermark. Counts never go
+    # down, so a product outside the current top k that got no new items
+    # cannot enter it: ranking the old top k plus the touched products is
+    # enough, and the cost follows the number of new items.
+    global recommendations, top, watermark
+    with refresh_lock:
+        new_items = 0
+        touched = set()
+        try:
+            while True:
+                response = requests.get("http://order:5000/api/orderitems/changes",
+                                        params={"since": watermark, "limit": CHANGES_PAGE_SIZE}, timeout=10)
+                response.raise_for_status()
+                data = response.json()
+                if not data["items"]:
+                    break
+                touched |= apply_items(data["items"])
+                new_items += len(data["items"])
+                watermark = data["next"]
+        finally:
+            # keep what was counted even if a later page failed
+            if new_items:
+                top = rank(top + list(touched))
+                # the co-occurrence table is rebuilt by rebuild_loop, here the
+                # new pairs are only appended to the pairs file
+                save_pairs()
+                save_state()
+                if len(pair_orders) - built_pairs >= REBUILD_MIN_PAIRS:
+                    rebuild_needed.set()
+                with lock:
+                    recommendations = list(top)
+                    with open(DATA_FILE, "wb") as f:
+                        pickle.dump(recommendations, f)
+
+    return jsonify({"success": True, "new_items": new_items, "watermark": watermark, "count": len(recommendations)}), 200
@@ -0,0 +1,33 @@
+import numpy as np
+from scipy import sparse
+
+def build_neighbors(order_idx, product_idx, num_products: int, top_n: int):
+    # order_idx and product_idx hold one entry per order item as dense ints.
+    # Returns (indptr, neighbors, counts) in csr layout: the neighbors of
+    # product p are neighbors[indptr[p]:indptr[p + 1]], most co-ordered first,
+    # counts is the number of orders holding both products.
+    order_idx = np.asarray(order_idx, dtype=np.int64)
+    product_idx = np.asarray(product_idx, dtype=np.int64)
+    if len(order_idx) == 0:
+        return np.zeros(num_products + 1, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # order x product incidence, an order counts once per product whatever the quantity
+    orders = sparse.coo_matrix((np.ones(len(order_idx), dtype=np.int32), (order_idx, product_idx)),
+                               shape=(int(order_idx.max()) + 1, num_products)).tocsr()
+    orders.data[:] = 1
+    co = (orders.T @ orders).tocoo()
+
+    keep = co.row != co.col
+    rows, cols, counts = co.row[keep].astype(np.int64), co.col[keep].astype(np.int64), co.data[keep].astype(np.int64)
+    # by product, strongest first, ties by index so rebuilds are stable
+    order = np.lexsort((cols, -counts, rows))
+    rows, cols, counts = rows[order], cols[order], counts[order]
+
+    # position of every entry inside its row, keep the first top_n
+    starts = np.searchsorted(rows, np.arange(num_products))
+    keep = np.arange(len(rows)) - starts[rows] < top_n
+    rows, cols, counts = rows[keep], cols[keep], counts[keep]
+
+    indptr = np.zeros(num_products + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_products), out=indptr[1:])
+    return indptr, cols, counts
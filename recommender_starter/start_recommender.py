@@ -1,15 +1,18 @@
 import asyncio
 from temporalio.client import Client
+from temporalio.common import WorkflowIDConflictPolicy
 from workflows import RecommendationWorkflow 
 
 async def main():
     await asyncio.sleep(5)
     client = await Client.connect("temporal-core:7233")
     print("Starting recommendation workflow...")
+    # replaces a run left over from an older deploy, which may still be on the full recount
     await client.start_workflow(
         RecommendationWorkflow.run,
         id="recommendations",
         task_queue="my-task-queue",
+        id_conflict_policy=WorkflowIDConflictPolicy.TERMINATE_EXISTING,
     )
     print("Workflow started.")
 
@@ -9,17 +9,22 @@ with workflow.unsafe.imports_passed_through():
     from activities import (
         reserve_items, 
         release_items,
+        confirm_items,
         get_total_price, 
         simulate_payment, 
+        refund_payment,
         store_order, 
         store_order_items,
+        store_order_with_items,
         get_user_email,
         send_email,
         set_shipping_done,
         get_order_items,
         compute_popular_item_ranking,
         set_recommendations,
+        refresh_recommendations,
         get_user,
+        verify_user,
     )
     from shared import (
         OrderInfo, 
@@ -90,32 +95,63 @@ class OrderWorkflow:
             )
             raise e
 
-        # 4. Store order
+        # the reservation would otherwise expire and go back to stock, runs
+        # recorded before confirmation existed replay without the step
+        if workflow.patched("confirm-reservation"):
+            try:
+                await workflow.execute_activity(
+                    confirm_items, ReservationInput(reservation_id, self.cart_items),
+                    start_to_close_timeout=timedelta(seconds=15),
+                    retry_policy=retry_policy,
+                )
+            except ActivityError as e:
+                # the stock could not be kept for this order, give the money back
+                await workflow.execute_activity(
+                    refund_payment, self.info,
+                    start_to_close_timeout=timedelta(seconds=15),
+                    retry_policy=retry_policy,
+                )
+                raise e
+
+        # 4. Store order and its items in one request
         self.info.order_id = str(workflow.uuid4())
-        result = await workflow.execute_activity(
-            store_order, self.info,
-            start_to_close_timeout=timedelta(seconds=15),
-            retry_policy=retry_policy,
-        )
-        workflow.logger.info(f"Order creation result: {result}")
+        if workflow.patched("store-order-with-items"):
+            order_items_ids=[str(workflow.uuid4()) for _ in self.cart_items]
+            result = await workflow.execute_activity(
+                store_order_with_items, StoreOrderItemsInput(
+                    info=self.info, 
+                    cart_items=self.cart_items,
+                    order_items_ids=order_items_ids
+                ),
+                start_to_close_timeout=timedelta(seconds=15),
+                retry_policy=retry_policy,
+            )
+            workflow.logger.info(f"Order creation result: {result}")
+        else:
+            # runs recorded before the single request replay the two old steps
+            result = await workflow.execute_activity(
+                store_order, self.info,
+                start_to_close_timeout=timedelta(seconds=15),
+                retry_policy=retry_policy,
+            )
+            workflow.logger.info(f"Order creation result: {result}")
 
-        # 5. Store order items
-        order_items_ids=[str(workflow.uuid4()) for _ in self.cart_items]
-        await workflow.execute_activity(
-            store_order_items, StoreOrderItemsInput(
-                info=self.info, 
-                cart_items=self.cart_items,
-                order_items_ids=order_items_ids
-            ),
-            start_to_close_timeout=timedelta(seconds=15),
-            retry_policy=retry_policy,
-        )
+            order_items_ids=[str(workflow.uuid4()) for _ in self.cart_items]
+            await workflow.execute_activity(
+                store_order_items, StoreOrderItemsInput(
+                    info=self.info, 
+                    cart_items=self.cart_items,
+                    order_items_ids=order_items_ids
+                ),
+                start_to_close_timeout=timedelta(seconds=15),
+                retry_policy=retry_policy,
+            )
 
-        # 6. Send message to recommendation workflow
+        # 5. Send message to recommendation workflow
         handle = workflow.get_external_workflow_handle("recommendations")
         await handle.signal(RecommendationWorkflow.start)
 
-        # 7. Send email notification
+        # 6. Send email notification
         user_mail_address = await workflow.execute_activity(
             get_user_email, self.info,
             start_to_close_timeout=timedelta(seconds=15),
@@ -128,7 +164,7 @@ class OrderWorkflow:
             retry_policy=retry_policy,
         )
 
-        # 6. Dispatch shipping workflow
+        # 7. Dispatch shipping workflow
         await workflow.execute_child_workflow(
             ShippingWorkflow.run, self.info.order_id,
             id="shipping:"+self.info.session_id,
@@ -227,21 +263,56 @@ class ShippingWorkflow:
     def get_status(self) -> ShippingInfo:
         return self.info
     
+# refreshes per run before continuing as new, keeps the event history bounded
+REFRESHES_PER_RUN = 1000
+
 @workflow.defn
 class RecommendationWorkflow:
     def __init__(self):
         self.do_run = True
 
     @workflow.run
-    async def run(self):
-
-        await workflow.sleep(timedelta(seconds=30))
-
+    async def run(self, continued: bool = False):
         retry_policy = RetryPolicy(
             maximum_attempts=3,
             initial_interval=timedelta(seconds=5),
         )
 
+        if not workflow.patched("incremental-refresh"):
+            # runs started before the incremental refresh replay the full
+            # recount, start_recommender replaces them with a fresh run
+            await self.run_full_recount(retry_policy)
+            return
+
+        if not continued:
+            await workflow.sleep(timedelta(seconds=30))
+
+            await workflow.execute_activity(
+                refresh_recommendations,
+                start_to_close_timeout=timedelta(seconds=60),
+                retry_policy=retry_policy,
+            )
+
+        for _ in range(REFRESHES_PER_RUN):
+            await workflow.wait_condition(
+                lambda: self.do_run and workflow.all_handlers_finished()
+            )
+
+            await workflow.execute_activity(
+                refresh_recommendations,
+                start_to_close_timeout=timedelta(seconds=60),
+                retry_policy=retry_policy,
+            )
+
+            self.do_run = False
+
+        # the next run starts with do_run set, so a signal that came in meanwhile is not lost
+        await workflow.wait_condition(workflow.all_handlers_finished)
+        workflow.continue_as_new(True)
+
+    async def run_full_recount(self, retry_policy: RetryPolicy):
+        await workflow.sleep(timedelta(seconds=30))
+
         order_items = await workflow.execute_activity(
             get_order_items,
             start_to_close_timeout=timedelta(seconds=15),
@@ -299,7 +370,18 @@ class LoginWorkflow:
         )
 
         try:
+            if workflow.patched("verify-credentials"):
+                # the user service checks the password hash, no credentials come back
+                user = await workflow.execute_activity(
+                    verify_user, input,
+                    start_to_close_timeout=timedelta(seconds=15),
+                    retry_policy=retry_policy,
+                )
+                if user is not None:
+                    return LoginOutput(True, user.get("id"), user.get("username"), user.get("realname"), user.get("email"))
+                return LoginOutput(False, "", "", "", "")
 
+            # runs recorded before verification existed replay the old comparison
             user = await workflow.execute_activity(
                 get_user, input.username,
                 start_to_close_timeout=timedelta(seconds=15),
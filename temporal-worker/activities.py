@@ -4,7 +4,7 @@ from temporalio import activity
 import random
 import uuid
 
-from shared import CartItem, OrderInfo, StoreOrderItemsInput, EmailInput, ReservationInput
+from shared import CartItem, OrderInfo, StoreOrderItemsInput, EmailInput, ReservationInput, LoginInput
 
 ### ORDER ###
 
@@ -25,7 +25,8 @@ async def reserve_items(input: ReservationInput):
     payload = {
         "product_ids": [item.product_id for item in input.cart_items],
         "quantities": [item.quantity for item in input.cart_items],
-        "reservation_id": input.reservation_id
+        "reservation_id": input.reservation_id,
+        "expires": True  # the workflow confirms it once the payment went through
     }
     resp = requests.post("http://inventory:5000/api/inventory/check_and_reserve", json=payload)
     if 400 <= resp.status_code < 500:
@@ -42,6 +43,26 @@ async def release_items(reservation_id: str):
     resp = requests.post("http://inventory:5000/api/inventory/release", json=payload)
     resp.raise_for_status()
 
+@activity.defn
+async def confirm_items(input: ReservationInput):
+    resp = requests.post("http://inventory:5000/api/inventory/confirm", json={"reservation_id": input.reservation_id})
+    if resp.status_code in (404, 409):
+        # The reservation expired (and may already be forgotten) before the
+        # payment went through: take the stock again under an id derived from
+        # the old one, so retries of this activity reuse it.
+        retry_id = input.reservation_id + ":reconfirm"
+        payload = {
+            "product_ids": [item.product_id for item in input.cart_items],
+            "quantities": [item.quantity for item in input.cart_items],
+            "reservation_id": retry_id
+        }
+        resp = requests.post("http://inventory:5000/api/inventory/check_and_reserve", json=payload)
+        if resp.status_code >= 500:
+            raise NotEnoughInventoryError("The reservation expired and the stock is gone.")
+        resp.raise_for_status()
+        resp = requests.post("http://inventory:5000/api/inventory/confirm", json={"reservation_id": retry_id})
+    resp.raise_for_status()
+
 @activity.defn
 async def get_total_price(cart_items: list[CartItem]) -> int:
     product_ids = [i.product_id for i in cart_items]
@@ -61,6 +82,10 @@ async def simulate_payment(order_info: OrderInfo):
         print(f"❌ Payment failed for user {order_info.user_id}, amount: {order_info.total_price} cents")
         raise NotEnoughFundsPaymentError("Not enough money in the bank.")
 
+@activity.defn
+async def refund_payment(order_info: OrderInfo):
+    print(f"↩️ Payment refunded for user {order_info.user_id}, amount: {order_info.total_price} cents")
+
 @activity.defn
 async def store_order(order_info: OrderInfo) -> str:
     order_data = {
@@ -83,21 +108,52 @@ async def store_order(order_info: OrderInfo) -> str:
     response.raise_for_status()
     return "created"
 
+@activity.defn
+async def store_order_with_items(input: StoreOrderItemsInput) -> str:
+    # the order and all its items in one request, the item ids make retries idempotent
+    order_info = input.info
+    order_data = {
+        "id": order_info.order_id,
+        "user_id": order_info.user_id,
+        "total_price_in_cents": order_info.total_price,
+        "address_name": order_info.address_name,
+        "address1": order_info.address1,
+        "address2": order_info.address2,
+        "credit_card_company": order_info.credit_card_company,
+        "credit_card_number": order_info.credit_card_number,
+        "credit_card_expiry": order_info.credit_card_expiry,
+        "shipping_workflow_id": "shipping:"+order_info.session_id,
+        "items": [
+            {"id": id, "product_id": item.product_id, "quantity": item.quantity}
+            for item, id in zip(input.cart_items, input.order_items_ids)
+        ]
+    }
+
+    response = requests.post("http://order:5000/api/orders/with_items", json=order_data)
+    if response.status_code == 409:
+        # Already exists — consider this a success
+        return "already_exists"
+    response.raise_for_status()
+    return "created"
+
 @activity.defn
 async def store_order_items(input: StoreOrderItemsInput):
-    for item, id in zip(input.cart_items, input.order_items_ids):
-        order_item_data = {
+    items = [
+        {
             "id": id,
             "product_id": item.product_id,
-            "order_id": input.info.order_id,  
+            "order_id": input.info.order_id,
             "quantity": item.quantity
         }
+        for item, id in zip(input.cart_items, input.order_items_ids)
+    ]
 
-        response = requests.post("http://order:5000/api/orderitems", json=order_item_data)
-        if response.status_code == 409:
-            continue
-
-        response.raise_for_status()
+    response = requests.post("http://order:5000/api/orderitems/batch", json={"items": items})
+    response.raise_for_status()
+    for result in response.json()["results"]:
+        # 409 means the item is already stored
+        if result["status"] not in (200, 409):
+            raise RuntimeError(f"Storing order item failed: {result}")
 
 @activity.defn
 async def get_user_email(order_info: OrderInfo) -> str:
@@ -140,7 +196,7 @@ async def compute_popular_item_ranking(order_items):
         p_id = item.get("product_id")
         counts[p_id] = counts.get(p_id, 0) + item.get("quantity", 1)
     
-    counts = sorted(counts.items(), key=lambda x: x[1])
+    counts = sorted(counts.items(), key=lambda x: x[1], reverse=True)
     counts = [x[0] for x in counts]
     return counts
 
@@ -149,6 +205,13 @@ async def set_recommendations(counts):
     response = requests.post("http://recommender:5000/api/recommendations", json=counts)
     response.raise_for_status()
 
+@activity.defn
+async def refresh_recommendations():
+    # the recommender counts only the order items added since its last refresh
+    response = requests.post("http://recommender:5000/api/recommendations/refresh")
+    response.raise_for_status()
+    return response.json()
+
 ### LOGIN ###
 @activity.defn
 async def get_user(username: str):
@@ -156,3 +219,12 @@ async def get_user(username: str):
     resp.raise_for_status()
     user_data = resp.json()
     return user_data
+
+@activity.defn
+async def verify_user(input: LoginInput) -> dict | None:
+    # the public profile, or None for a wrong username or password
+    resp = requests.post("http://user:5000/api/users/verify", json={"username": input.username, "password": input.password})
+    if resp.status_code in (400, 401):
+        return None
+    resp.raise_for_status()
+    return resp.json()
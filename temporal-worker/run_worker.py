@@ -6,17 +6,22 @@ from temporalio.worker import Worker
 from activities import (
     reserve_items, 
     release_items,
+    confirm_items,
     get_total_price, 
     simulate_payment, 
+    refund_payment,
     store_order, 
     store_order_items,
+    store_order_with_items,
     get_user_email,
     send_email,
     set_shipping_done,
     get_order_items,
     compute_popular_item_ranking,
     set_recommendations,
-    get_user
+    refresh_recommendations,
+    get_user,
+    verify_user
 )
 from workflows import OrderWorkflow, ShippingWorkflow, RecommendationWorkflow, LoginWorkflow
 
@@ -33,17 +38,22 @@ async def main() -> None:
         activities=[
             reserve_items, 
             release_items,
+            confirm_items,
             get_total_price, 
             simulate_payment, 
+            refund_payment,
             store_order, 
             store_order_items,
+            store_order_with_items,
             get_user_email,
             send_email,
             set_shipping_done,
             get_order_items,
             compute_popular_item_ranking,
             set_recommendations,
-            get_user
+            refresh_recommendations,
+            get_user,
+            verify_user
         ],
     )
     print("Starting worker.")
@@ -1,28 +1,81 @@
 from flask import Flask, request, jsonify, abort
 import os
+import hmac
 import pickle
+import hashlib
 from threading import Lock
 
 app = Flask(__name__)
 app.is_ready = False
 
+PASSWORD_HASH_ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", 100000))
+
+def hash_password(password: str, salt: bytes | None = None, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    # "pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>", the parameters travel with the hash
+    salt = salt if salt is not None else os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+def check_password_hash(password: str, password_hash: str) -> bool:
+    _, iterations, salt, _ = password_hash.split("$")
+    return hmac.compare_digest(hash_password(password, bytes.fromhex(salt), int(iterations)), password_hash)
+
 class User:
     def __init__(self, id: str, username: str, password: str, realname: str, email: str):
         self.id = id
         self.username = username
-        self.password = password
+        self.password_hash = hash_password(password)  # the plaintext is never stored
         self.realname = realname
         self.email = email
 
     def to_dict(self):
+        return self.public_dict()
+
+    def public_dict(self):
         return {
             "id": self.id,
             "username": self.username,
             "realname": self.realname,
             "email": self.email,
-            "password": self.password,
         }
     
+class UserDirectory:
+    # Immutable view of the users and their indexes. Readers grab the current
+    # directory once per request and never lock; writers build a new one and
+    # swap it in. Usernames are matched case-insensitively, on a clash the
+    # first user wins.
+    def __init__(self, version: int, users: list[User]):
+        self.version = version
+        self.users = users
+        self.users_by_id = {u.id: u for u in users}
+        self.users_by_username: dict[str, User] = {}
+        for u in users:
+            self.users_by_username.setdefault(u.username.lower(), u)
+
+directory = UserDirectory(0, [])
+write_lock = Lock()  # serializes writers only
+
+def set_users(new_users: list[User]):
+    global directory
+    with write_lock:
+        directory = UserDirectory(directory.version + 1, new_users)
+
+MAX_BULK_USERS = 1000
+
+# compared against for unknown users so every failed login costs one pbkdf2 run
+DUMMY_HASH = hash_password("")
+
+def hash_legacy_users(users: list[User]) -> bool:
+    # users.pkl from older builds holds plaintext passwords, hash them once on load
+    changed = False
+    for user in users:
+        if getattr(user, "password_hash", None) is None:
+            user.password_hash = hash_password(user.password)
+            changed = True
+        if "password" in vars(user):
+            del user.password
+            changed = True
+    return changed
 USERS_FILE = "users.pkl"
 
 # Load persisted data if available
@@ -40,45 +93,72 @@ try:
         # Save initial state
         with open(USERS_FILE, "wb") as f:
             pickle.dump(users, f)
+    if hash_legacy_users(users):
+        tmp_path = USERS_FILE + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(users, f)
+        os.replace(tmp_path, USERS_FILE)
+    set_users(users)
     app.is_ready = True
 except:
     app.is_ready = False
 
-lock = Lock()
-
-def find_by_id(items, id):
-    return next((item for item in items if item.id == id), None)
-
 @app.route("/api/users/<id>", methods=["GET"])
 def get_user(id):
-    with lock:
-        user = find_by_id(users, id)
+    user = directory.users_by_id.get(id)
     if user:
         return jsonify(user.to_dict())
     abort(404)
 
 @app.route("/api/users/username/<username>", methods=["GET"])
 def get_user_by_name(username):
-    with lock:
-        user = next((item for item in users if item.username == username), None)
+    user = directory.users_by_username.get(username.lower())
     if user:
         return jsonify(user.to_dict())
     abort(404)
 
+@app.route("/api/users/bulk", methods=["POST"])
+def get_users_bulk():
+    # {"ids": [...]} and/or {"usernames": [...]}, returns public profiles of
+    # the unique matches in request order, unknown ids and names are skipped
+    data = request.get_json()
+    if not isinstance(data, dict) or ("ids" not in data and "usernames" not in data):
+        abort(400, description="Missing 'ids' or 'usernames' in request body")
+    ids = data.get("ids", [])
+    usernames = data.get("usernames", [])
+    if not isinstance(ids, list) or not isinstance(usernames, list):
+        abort(400, description="'ids' and 'usernames' must be lists")
+    if len(ids) + len(usernames) > MAX_BULK_USERS:
+        abort(400, description=f"At most {MAX_BULK_USERS} users per request")
+
+    snapshot = directory
+    found = [snapshot.users_by_id.get(str(id)) for id in ids]
+    found += [snapshot.users_by_username.get(str(name).lower()) for name in usernames]
+    unique = {user.id: user for user in found if user is not None}
+    return jsonify([user.public_dict() for user in unique.values()])
+
+@app.route("/api/users/verify", methods=["POST"])
+def verify_user():
+    # {"username", "password"} -> public profile, or 401 without saying which part was wrong
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get("username"), str) or not isinstance(data.get("password"), str):
+        abort(400, description="'username' and 'password' are required")
+
+    snapshot = directory
+    user = snapshot.users_by_username.get(data["username"].lower())
+    # unknown users run against DUMMY_HASH so both answers take the same time
+    password_hash = user.password_hash if user is not None else DUMMY_HASH
+    if not check_password_hash(data["password"], password_hash) or user is None:
+        return jsonify({"error": "Invalid username or password"}), 401
+    return jsonify(user.public_dict())
+
 @app.route("/healthz")
 def healthz():
-    if lock.acquire(timeout=1):  # try for 1 second
-        try:
-            return jsonify(status="alive"), 200
-        finally:
-            lock.release()
-    else:
-        return jsonify(status="locked"), 500
+    return jsonify(status="alive", directory_version=directory.version), 200
 
 @app.route("/ready")
 def ready():
     if not app.is_ready:
         return jsonify(status="not ready"), 503
     else:
-        with lock:
-            return jsonify(status="ready"), 200
\ No newline at end of file
+        return jsonify(status="ready"), 200
\ No newline at end of file
@@ -1,16 +1,26 @@
 import asyncio
-from flask import Flask, render_template, redirect, session, flash, request, make_response, jsonify, current_app
+import os
+import copy
+from flask import Flask, Response, render_template, redirect, session, flash, request, make_response, jsonify, current_app
 import requests
 from math import ceil
 import uuid
+import time
 import random
+import secrets
 from temporalio.client import Client
 from workflows import ShippingWorkflow, LoginWorkflow, OrderWorkflow
 from shared import LoginInput, OrderInput, CartItem, OrderInfo
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 app = Flask(__name__)
-app.secret_key = "123456789"
+# the session cookie is a signed token holding the session id, the user id
+# and a few flags; profiles and orders are looked up server side
+app.secret_key = os.environ.get("SECRET_KEY")
+if not app.secret_key:
+    # never a known default, it would let anyone forge a logged in session
+    app.secret_key = secrets.token_hex(32)
+    print("SECRET_KEY is not set, using a random key: sessions end on restart and are not shared between replicas")
 app.is_ready = False
 
 async def connect_temporal(app):
@@ -25,11 +35,48 @@ MAX_CACHE_SIZE = 3
 category_cache: dict[str, dict] = {}
 products_cache: dict[str, list[dict]] = {}
 
+# url -> (etag, parsed body) for conditional GETs against the product service
+MAX_CONDITIONAL_CACHE_SIZE = 256
+conditional_cache: dict[str, tuple[str, object]] = {}
+
+def get_json_conditional(url):
+    cached = conditional_cache.get(url)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    response = requests.get(url, headers=headers)
+    if response.status_code == 304 and cached:
+        return copy.deepcopy(cached[1])
+    response.raise_for_status()
+    data = response.json()
+    etag = response.headers.get("ETag")
+    if etag:
+        conditional_cache.pop(url, None)
+        conditional_cache[url] = (etag, data)
+        if len(conditional_cache) > MAX_CONDITIONAL_CACHE_SIZE:
+            conditional_cache.pop(next(iter(conditional_cache)), None)
+        return copy.deepcopy(data)
+    return data
+
 GENERIC_IMAGE_URL = "/static/images/placeholder.png"
-def get_images(image_names: list[str]) -> tuple[dict[str, str], list[str]]:
+# opt-in: render plain image urls (served through /images/<name>) instead of inline data uris
+USE_IMAGE_URLS = os.environ.get("USE_IMAGE_URLS", "false").lower() == "true"
+IMAGE_URL_PREFIX = os.environ.get("IMAGE_URL_PREFIX", "/images")
+# encoding requested for downscaled variants, the "full" size is always the original png
+IMAGE_VARIANT_FORMAT = os.environ.get("IMAGE_VARIANT_FORMAT", "webp")
+THUMB_SIZE = "thumb"  # product_item.html, 72px wide
+CARD_SIZE = "card"  # product.html showcase picture
+
+def image_variant_query(size) -> str:
+    return f"size={size}&format={IMAGE_VARIANT_FORMAT}"
+
+def get_image_url(image_name, size) -> str:
+    return f"{IMAGE_URL_PREFIX}/{image_name}?{image_variant_query(size)}"
+
+def get_images(image_names: list[str], size=THUMB_SIZE) -> tuple[dict[str, str], list[str]]:
+    if USE_IMAGE_URLS:
+        return {name: get_image_url(name, size) for name in image_names}, []
     try:
         query = ",".join(image_names)
-        url = f"http://image:5000/api/images?names={query}"
+        url = f"http://image:5000/api/images?names={query}&{image_variant_query(size)}"
         response = requests.get(url)
         response.raise_for_status()  # Raise error if request failed
         images_list = response.json()
@@ -41,9 +88,11 @@ def get_images(image_names: list[str]) -> tuple[dict[str, str], list[str]]:
         # all failed
         return {name: GENERIC_IMAGE_URL for name in image_names}, image_names
 
-def get_image(image_name) -> tuple[str, bool]:
+def get_image(image_name, size=CARD_SIZE) -> tuple[str, bool]:
+    if USE_IMAGE_URLS:
+        return get_image_url(image_name, size), True
     try:
-        url = f"http://image:5000/api/images?names={image_name}"
+        url = f"http://image:5000/api/images?names={image_name}&{image_variant_query(size)}"
         response = requests.get(url)
         response.raise_for_status()  # Raise error if request failed
         images_list = response.json()
@@ -51,20 +100,46 @@ def get_image(image_name) -> tuple[str, bool]:
     except Exception:
         return GENERIC_IMAGE_URL, False
     
+# forwarded in both directions so browsers can revalidate and fetch ranges
+IMAGE_REQUEST_HEADERS = ["If-None-Match", "If-Modified-Since", "Range", "If-Range"]
+IMAGE_RESPONSE_HEADERS = ["Content-Type", "ETag", "Cache-Control", "Last-Modified", "Accept-Ranges", "Content-Range"]
+
+@app.route("/images/<name>")
+def image_proxy(name):
+    headers = {h: request.headers[h] for h in IMAGE_REQUEST_HEADERS if h in request.headers}
+    try:
+        response = requests.get(f"http://image:5000/api/images/{name}", params=request.args, headers=headers)
+    except Exception:
+        return redirect(GENERIC_IMAGE_URL)
+    if response.status_code == 404:
+        return redirect(GENERIC_IMAGE_URL)
+    return Response(
+        response.content,
+        status=response.status_code,
+        headers={h: response.headers[h] for h in IMAGE_RESPONSE_HEADERS if h in response.headers},
+    )
+
 @app.route("/retry-image")
 def retry_image():
     name = request.args.get("name")
+    size = request.args.get("size", CARD_SIZE)
     if not name:
         return jsonify({"error": "No image name provided"}), 400
-    image, ok = get_image(name)
+    image, ok = get_image(name, size)
     if ok:
         return jsonify({"image": image})
     else:
         return jsonify({"error": "could not load image, returned placeholder"})
 
-def get_recommendations(num=3):
+def get_recommendations(num=3, product_id=None, cart=None):
+    # product_id / cart ask for products ordered together with them
+    params = {"num": num}
+    if product_id is not None:
+        params["product_id"] = product_id
+    elif cart:
+        params["cart"] = ",".join(cart)
     try:
-        response = requests.get(f"http://recommender:5000/api/recommendations?num={num}")
+        response = requests.get("http://recommender:5000/api/recommendations", params=params)
         response.raise_for_status()
         data = response.json()
         return [i for i in data]
@@ -101,6 +176,9 @@ async def ensure_session_id():
             OrderInput(session["session_id"], (session["user_id"] if "user_id" in session else None)),
             id=session["session_id"], task_queue="my-task-queue"
         )
+    # cookies issued before profiles and orders moved server side
+    session.pop("user_data", None)
+    session.pop("last_orders", None)
     if "login_pending" in session and session["login_pending"] and "user_id" not in session:
         print("Login is pending")
         client = get_client()
@@ -111,11 +189,12 @@ async def ensure_session_id():
             if result:
                 if result["success"]:
                     session["user_id"] = result["user_id"]
-                    session["user_data"] = {
+                    remember_identity({
+                        "id": result["user_id"],
                         "realname": result["realname"],
                         "email": result["email"],
                         "username": result["username"],
-                    }
+                    })
                     session.pop("login_pending", None)
 
                     # signal order workflow that login succeeded
@@ -130,18 +209,9 @@ async def ensure_session_id():
             # No result yet — login still pending
             pass
 
-    # cache newest 3 user orders in session
-    if "user_id" in session and "last_orders" not in session:
-        orders: list[dict] = get_user_orders(session["user_id"])
-        if orders:
-            sorted_orders = sorted(orders, key=lambda x: datetime.strptime(x.get("time"), "%Y-%m-%dT%H:%M:%S.%f"))
-            session["last_orders"] = sorted_orders[:3]
-
 def get_category_list():
     try:
-        response = requests.get(f"http://product:5000/api/categories")
-        response.raise_for_status()  # Raise error if request failed
-        data = response.json()
+        data = get_json_conditional("http://product:5000/api/categories")
 
         for category in data:
             category_cache[category["id"]] = category.copy()
@@ -155,24 +225,55 @@ def index():
     category_list = get_category_list()
     return render_template_base("index.html", category_list=category_list)
 
+# user id -> (fetched at, public profile), least recently used first. An entry
+# is used while it is younger than IDENTITY_TTL, so profile edits show up
+# within that time.
+IDENTITY_TTL = float(os.environ.get("IDENTITY_TTL", 300))
+MAX_IDENTITY_CACHE_SIZE = 4096
+identity_cache: dict[str, tuple[float, dict]] = {}
+
+def remember_identity(user: dict):
+    identity_cache.pop(user["id"], None)
+    identity_cache[user["id"]] = (time.time(), user)
+    if len(identity_cache) > MAX_IDENTITY_CACHE_SIZE:
+        identity_cache.pop(next(iter(identity_cache)), None)
+
 def get_user(user_id):
+    cached = identity_cache.get(user_id)
+    if cached and time.time() - cached[0] < IDENTITY_TTL:
+        # another request may have moved or evicted it since the get
+        identity_cache.pop(user_id, None)
+        identity_cache[user_id] = cached
+        return dict(cached[1])
     try:
-        response = requests.get(f"http://user:5000/api/users/{user_id}")
-        response.raise_for_status()  
+        response = requests.post("http://user:5000/api/users/bulk", json={"ids": [user_id]})
+        response.raise_for_status()
         data = response.json()
-        session["user_data"] = data
-        return data
+        if not data:
+            return None
+        remember_identity(data[0])
+        return dict(data[0])
     except Exception:
-        return session.get("user_data", None)
+        # a stale profile beats none while the user service is down
+        return dict(cached[1]) if cached else None
+
+PROFILE_ORDERS_PAGE_SIZE = 10
+# user id -> first profile page, shown when the order service is unreachable
+MAX_RECENT_ORDERS_CACHE_SIZE = 1024
+recent_orders_cache: dict[str, list[dict]] = {}
 
-def get_user_orders(user_id):
+def get_user_orders(user_id, limit, before=None) -> tuple[list[dict], str | None] | None:
+    # newest first, returns the page and the cursor for the next older one
     try:
-        response = requests.get(f"http://order:5000/api/orders/{user_id}")
+        params = {"limit": limit}
+        if before:
+            params["before"] = before
+        response = requests.get(f"http://order:5000/api/orders/{user_id}", params=params)
         response.raise_for_status() 
         data = response.json()
-        return data
+        return data["orders"], data["next_before"]
     except:
-        return []
+        return None
 
 @app.route("/profile")
 async def profile():
@@ -195,15 +296,20 @@ async def profile():
             "realname": "-",
             "email": "-"
         }
-    orders: list[dict] = get_user_orders(user_id)
-
-    if orders:
-        sorted_orders = sorted(orders, key=lambda x: datetime.strptime(x.get("time"), "%Y-%m-%dT%H:%M:%S.%f"))
-        session["last_orders"] = sorted_orders[:3]
+    before = request.args.get("before")
+    result = get_user_orders(user_id, PROFILE_ORDERS_PAGE_SIZE, before)
+
+    next_before = None
+    if result is not None:
+        orders, next_before = result
+        if not before:
+            recent_orders_cache.pop(user_id, None)
+            recent_orders_cache[user_id] = copy.deepcopy(orders)
+            if len(recent_orders_cache) > MAX_RECENT_ORDERS_CACHE_SIZE:
+                recent_orders_cache.pop(next(iter(recent_orders_cache)), None)
         is_orders_fresh = True
     else:
-        if "last_orders" in session:
-            orders = session["last_orders"]
+        orders = [] if before else copy.deepcopy(recent_orders_cache.get(user_id, []))
         is_orders_fresh = False
 
     for order in orders:
@@ -215,7 +321,34 @@ async def profile():
             results = await handle.query(ShippingWorkflow.get_status)
             order["status"] = results.status
 
-    return render_template_base("profile.html", category_list=category_list, user=user, orders=orders, is_orders_fresh=is_orders_fresh)
+    return render_template_base("profile.html", category_list=category_list, user=user, orders=orders, is_orders_fresh=is_orders_fresh, next_before=next_before)
+
+# "workflow" runs the LoginWorkflow and picks up its result on a later request,
+# "sync" checks the credentials against the user service during the POST
+LOGIN_MODE = os.environ.get("LOGIN_MODE", "workflow")
+
+async def verify_login(username, password) -> bool | None:
+    # True/False for valid/invalid credentials, None when the user service or
+    # the cart's workflow could not be reached
+    try:
+        response = requests.post("http://user:5000/api/users/verify", json={"username": username, "password": password}, timeout=5)
+        if response.status_code in (400, 401):
+            return False
+        response.raise_for_status()
+        user = response.json()
+    except Exception:
+        return None
+
+    # same hand-off the workflow path does once its result arrives, before the
+    # session says logged in so a failed hand-off leaves the user logged out
+    try:
+        order_handle = get_client().get_workflow_handle(session["session_id"])
+        await order_handle.signal(OrderWorkflow.upgrade_user, user["id"])
+    except Exception:
+        return None
+    session["user_id"] = user["id"]
+    remember_identity(user)
+    return True
 
 async def call_login(username, password):
     try:
@@ -239,6 +372,13 @@ async def login():
         username = request.form.get("username")
         password = request.form.get("password")
         referer = request.form.get("referer", None)
+        if LOGIN_MODE == "sync":
+            verified = await verify_login(username, password)
+            if verified:
+                flash("You are logged in now.")
+                return redirect(referer or "/")
+            flash("Login failed." if verified is False else "Could not log in. Please try again.")
+            return render_template_base("login.html", referer=referer, category_list=get_category_list())
         if await call_login(username, password):
             flash("Login process started.")
             if referer:
@@ -263,8 +403,7 @@ async def login():
 def call_logout():
     # also need changes here
     session.pop("session_id")
-    session.pop("user_id")
-    session.pop("user_data")
+    session.pop("user_id", None)
     session.pop("login_pending", None)
     return True
 
@@ -287,15 +426,51 @@ def get_category(category_id):
     except Exception:
         return category_cache.get(category_id, None)
 
-def get_products_for_category(category_id):
+def get_products_for_category(category_id, offset, limit) -> tuple[list[dict], int] | None:
     try:
-        response = requests.get(f"http://product:5000/api/categories/{category_id}/products")
+        data = get_json_conditional(f"http://product:5000/api/categories/{category_id}/products?offset={offset}&limit={limit}")
+        products = data["products"]
+        if offset == 0:
+            products_cache[category_id] = products[:MAX_CACHE_SIZE].copy() # cache 3 items at max per category
+        return products, data["total_count"]
+    except Exception:
+        cached = products_cache.get(category_id, None)
+        if cached is None:
+            return None
+        return cached[offset:offset + limit], len(cached)
+
+SEARCH_PAGE_SIZE = 20
+
+def search_products(query, limit=SEARCH_PAGE_SIZE):
+    try:
+        response = requests.get("http://product:5000/api/products/search", params={"q": query, "limit": limit})
         response.raise_for_status()
-        data = response.json()
-        products_cache[category_id] = data[:MAX_CACHE_SIZE].copy() # cache 100 items at max per category
-        return data
+        return response.json()["products"]
     except Exception:
-        return products_cache.get(category_id, None)
+        return None
+
+@app.route("/search")
+def search():
+    query = request.args.get("q", "").strip()
+    products = search_products(query) if query else []
+    if products is None:
+        message = {
+            "title": "Search is not available.",
+            "text": "There was an error in searching the products."
+        }
+        return render_template_base("error.html", message=message)
+
+    images, failed_images = get_images([p.get("img_name") for p in products])
+    for p in products:
+        p["image"] = images.get(p.get("img_name"))
+
+    category_list = get_category_list()
+    return render_template_base("search.html",
+                                category_list=category_list,
+                                products=products,
+                                search_query=query,
+                                failed_images=failed_images
+                                )
 
 @app.route("/category", methods=['GET', 'POST'])
 def category():
@@ -323,20 +498,22 @@ def category():
         }
         return render_template_base("error.html", message=message)
     
-    products = get_products_for_category(category_id)
-    if products is None:
+    result = get_products_for_category(category_id, max(page-1, 0)*selected_number_of_products, selected_number_of_products)
+    if result is None:
         message = {
             "title": "Products could not be loaded.",
             "text": "There was an error in loading the products."
         }
         return render_template_base("error.html", message=message)
-    products_page = products[(0 + (page-1)*selected_number_of_products):(page*selected_number_of_products)]
+    products_page, total_count = result
 
     images, failed_images = get_images([p.get("img_name") for p in products_page])
     for p in products_page:
         p["image"] = images.get(p.get("img_name"))
 
-    total_pages = ceil(len(products) / selected_number_of_products)
+    availability = get_availability([p.get("id") for p in products_page])
+
+    total_pages = ceil(total_count / selected_number_of_products)
     pagination = []
     if page > 1:
         pagination.append("previous")
@@ -354,7 +531,8 @@ def category():
                                 current_page_number=page,
                                 product_number_options=product_number_options,
                                 selected_number_of_products=selected_number_of_products,
-                                failed_images=failed_images
+                                failed_images=failed_images,
+                                availability=availability
                                 )
 
 def get_product(product_id):
@@ -388,6 +566,39 @@ def get_products(product_ids):
     
     return products
 
+# product id -> (fetched at, availability bucket), stock moves so keep it short
+STOCK_CACHE_TTL = float(os.environ.get("STOCK_CACHE_TTL", 5))
+MAX_STOCK_CACHE_SIZE = 1024
+stock_cache: dict[str, tuple[float, str]] = {}
+
+def get_availability(product_ids) -> dict[str, str]:
+    # one bulk request for whatever is not cached, an empty answer just hides the badges
+    now = time.time()
+    product_ids = [str(i) for i in product_ids]
+    result = {}
+    missing = []
+    for product_id in dict.fromkeys(product_ids):
+        cached = stock_cache.get(product_id)
+        if cached and now - cached[0] < STOCK_CACHE_TTL:
+            result[product_id] = cached[1]
+        else:
+            missing.append(product_id)
+    if not missing:
+        return result
+    try:
+        response = requests.get("http://inventory:5000/api/inventory/stock", params={"ids": ",".join(missing)}, timeout=2)
+        response.raise_for_status()
+        fetched = response.json()["availability"]
+    except Exception:
+        return result
+    for product_id, bucket in fetched.items():
+        stock_cache.pop(product_id, None)
+        stock_cache[product_id] = (now, bucket)
+    while len(stock_cache) > MAX_STOCK_CACHE_SIZE:
+        stock_cache.pop(next(iter(stock_cache)), None)
+    result.update(fetched)
+    return result
+
 @app.route("/product")
 def product():
     product_id = request.args.get('id', None)
@@ -406,10 +617,10 @@ def product():
         }
         return render_template_base("error.html", message=message)
     
-    product_image, product_image_ok = get_image(product.get("img_name"))
+    product_image, product_image_ok = get_image(product.get("img_name"), CARD_SIZE)
     product["image"] = product_image
 
-    ads_ids = get_recommendations()
+    ads_ids = get_recommendations(product_id=product_id)
     ads = get_products(ads_ids)
     ad_images, failed_ad_images = get_images([p.get("img_name") for p in ads])
     for p in ads:
@@ -420,8 +631,10 @@ def product():
         failed_images.append(product.get("img_name"))
     failed_images += failed_ad_images
 
+    availability = get_availability([product_id] + [p.get("id") for p in ads])
+
     category_list = get_category_list()
-    return render_template_base("product.html", category_list=category_list, product=product, ads=ads, failed_images=failed_images)
+    return render_template_base("product.html", category_list=category_list, product=product, ads=ads, failed_images=failed_images, availability=availability)
 
 @app.route("/cart")
 async def cart():
@@ -433,7 +646,7 @@ async def cart():
         p.get("id") : p for p in products
     }
 
-    ads_ids = get_recommendations()
+    ads_ids = get_recommendations(cart=[i.product_id for i in cart_items])
     ads = get_products(ads_ids)
     ad_images, failed_images = get_images([p.get("img_name") for p in ads])
     for p in ads: